@@ -10,94 +10,82 @@ import random
 import string
 from pathlib import Path
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 
 ROOT_DIR = Path(__file__).resolve().parent.parent
 
+# Compiled templates are cached in the system temp directory across runs
+EXPORTER_TEMPLATES_ENV = Environment(
+    loader=FileSystemLoader(ROOT_DIR.joinpath('templates')),
+    bytecode_cache=FileSystemBytecodeCache(), auto_reload=False)
+DASHBOARD_TEMPLATES_ENV = Environment(
+    loader=FileSystemLoader(ROOT_DIR.joinpath('grafana', 'templates')),
+    bytecode_cache=FileSystemBytecodeCache(), auto_reload=False)
+
 
 def generate_random_string(length=14):
     """Generate random uuid for Grafana dashboard."""
     characters = string.ascii_lowercase
-    return ''.join(random.choice(characters) for _ in range(length))
-
-
-def create_exporter_templates_env():
-    template_dir = ROOT_DIR.joinpath('templates')
-    env = Environment(loader=FileSystemLoader(template_dir))
-    return env
+    return ''.join(random.choices(characters, k=length))
 
 
-def create_group_file(env, group_name):
+def create_group_files(env, groups):
     template = env.get_template('couchdb_DEPT_exporter.py.jinja2')
-    group_file_path = ROOT_DIR.joinpath(
-        "src", "sw360_dashboard",
-        f"couchdb_{group_name.lower()}_exporter.py")
-    with group_file_path.open("w") as group_file:
-        group_file.write(template.render(group=group_name))
-        group_file.write("\n")
+    for group_name in groups:
+        group_file_path = ROOT_DIR.joinpath(
+            "src", "sw360_dashboard",
+            f"couchdb_{group_name.lower()}_exporter.py")
+        group_file_path.write_text(template.render(group=group_name) + "\n")
 
 
 def update_cli_file(env, groups):
     template = env.get_template('cli.py.jinja2')
     cli_file_path = ROOT_DIR.joinpath("src", "sw360_dashboard/cli.py")
-    with cli_file_path.open("w") as cli_file:
-        cli_file.write(template.render(groups=groups))
-        cli_file.write("\n")
+    cli_file_path.write_text(template.render(groups=groups) + "\n")
 
 
 def update_common_file(env, groups):
     template = env.get_template('couchdb_CLI_exporter.py.jinja2')
     common_file_path = ROOT_DIR.joinpath(
         "src", "sw360_dashboard", "couchdb_CLI_exporter.py")
-    with common_file_path.open("w") as common_file:
-        common_file.write(template.render(groups=groups))
-        common_file.write("\n")
-
-
-def create_dashboard_templates_env():
-    template_dir = ROOT_DIR.joinpath('grafana', 'templates')
-    env = Environment(loader=FileSystemLoader(template_dir))
-    return env
+    common_file_path.write_text(template.render(groups=groups) + "\n")
 
 
 def create_dashboard_cli_file(env, groups):
     template = env.get_template('cli.json.jinja2')
     cli_file_path = ROOT_DIR.joinpath("grafana", "dashboards", "cli.json")
-    with cli_file_path.open("w") as cli_file:
-        cli_file.write(template.render(groups=groups,
-                                       uuid=generate_random_string(14)))
+    cli_file_path.write_text(template.render(
+        groups=groups, uuid=generate_random_string(14)))
 
 
-def create_dashboard_file(env, group_name):
+def create_dashboard_files(env, groups):
     template = env.get_template('dept.json.jinja2')
-    group_file = ROOT_DIR.joinpath(
-        "grafana", "dashboards", f"{group_name.lower()}.json")
-    with group_file.open("w") as dashboard_file:
-        dashboard_file.write(template.render(group=group_name,
-                                             uuid=generate_random_string(14)))
+    for group_name in groups:
+        group_file = ROOT_DIR.joinpath(
+            "grafana", "dashboards", f"{group_name.lower()}.json")
+        group_file.write_text(template.render(
+            group=group_name, uuid=generate_random_string(14)))
 
 
 def copy_common_dashboard_files(env):
     template = env.get_template('global.json.jinja2')
     copy_file_path = ROOT_DIR.joinpath("grafana", "dashboards", "global.json")
-    with copy_file_path.open("w") as copy_file:
-        copy_file.write(template.render(uuid=generate_random_string(14)))
+    copy_file_path.write_text(
+        template.render(uuid=generate_random_string(14)))
 
 
 def generate_files(groups):
-    exporter_env = create_exporter_templates_env()
-    dashboard_env = create_dashboard_templates_env()
+    exporter_env = EXPORTER_TEMPLATES_ENV
+    dashboard_env = DASHBOARD_TEMPLATES_ENV
 
-    for group in groups:
-        create_group_file(exporter_env, group)
+    create_group_files(exporter_env, groups)
 
     update_cli_file(exporter_env, groups)
     update_common_file(exporter_env, groups)
 
     create_dashboard_cli_file(dashboard_env, groups)
-    for group in groups:
-        create_dashboard_file(dashboard_env, group)
+    create_dashboard_files(dashboard_env, groups)
     copy_common_dashboard_files(dashboard_env)
 
     print(f"Group files and CLI updated successfully for groups {groups}.")
@@ -9,11 +9,13 @@
 # -----------------------------------------------------------------------------
 
 import time
+from datetime import datetime, timedelta, timezone
 
 from botocore.exceptions import NoCredentialsError, ClientError
 from prometheus_client import CollectorRegistry, Gauge, delete_from_gateway
 from src.sw360_dashboard.couchdb_utils import (
-    get_pushgateway_url, push_metrics,
+    get_pushgateway_url, push_metrics_per_family, set_gauge_values,
+    pushgateway_handler,
 )
 
 from .aws_cloudwatch_utils import (
@@ -133,11 +135,10 @@ def collect_instance_distribution_metrics(instances):
         az_counts[az] = az_counts.get(az, 0) + 1
 
     # Update gauges
-    for itype, count in instance_type_counts.items():
-        instance_type_count.labels(instance_type=itype).set(count)
-
-    for az, count in az_counts.items():
-        availability_zone_count.labels(availability_zone=az).set(count)
+    set_gauge_values(instance_type_count, [
+        ((itype,), count) for itype, count in instance_type_counts.items()])
+    set_gauge_values(availability_zone_count, [
+        ((az,), count) for az, count in az_counts.items()])
 
 
 def main():
@@ -171,6 +172,7 @@ def main():
             delete_from_gateway(
                 get_pushgateway_url(), job='aws_cloudwatch_exporter',
                 grouping_key={'instance': 'latest'},
+                handler=pushgateway_handler,
             )
         except Exception as e:
             print(f"Warning: Could not clear metrics with grouping key: {e}")
@@ -178,6 +180,7 @@ def main():
         try:
             delete_from_gateway(
                 get_pushgateway_url(), job='aws_cloudwatch_exporter',
+                handler=pushgateway_handler,
             )
         except Exception as e:
             print(
@@ -194,11 +197,16 @@ def main():
 
         print(f"Found {len(instances)} running instances")
 
+        # Same metrics window for all queries of this run
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(minutes=15)  # Last 15 minutes
+
         # Collect EC2 instance metrics
         print("Collecting EC2 instance metrics...")
         collect_ec2_instance_metrics(
             ec2_client, cloudwatch_client, instances, running_instances_count,
             cpu_utilization, memory_utilization, network_in, network_out,
+            start_time, end_time,
         )
 
         # Collect EBS volume metrics
@@ -207,7 +215,7 @@ def main():
             ec2_client, cloudwatch_client, instances, volume_size,
             volume_used_size,
             volume_free_size, volume_utilization_percent, volume_iops,
-            volume_read_ops, volume_write_ops,
+            volume_read_ops, volume_write_ops, start_time, end_time,
         )
 
         # Collect distribution metrics
@@ -216,7 +224,7 @@ def main():
 
         # Push metrics to gateway
         print("Pushing metrics to Prometheus Push Gateway...")
-        push_metrics('aws_cloudwatch_exporter', registry)
+        push_metrics_per_family(registry, 'aws_cloudwatch_exporter')
 
         print("AWS CloudWatch Exporter completed successfully")
 
@@ -7,30 +7,51 @@
 # This module contains utility functions for AWS CloudWatch integration,
 # EC2 instance monitoring, and EBS volume metrics collection.
 
+import bisect
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, List, Tuple
 
-import backoff
 import boto3
 import dotenv
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from prometheus_client import Gauge
-from src.sw360_dashboard.couchdb_utils import (
-    backoff_printer, giveup_printer,
-)
 
 # Load environment variables from .env file
 dotenv.load_dotenv()
 
-MAX_BACKOFF_RETRIES = 5
-MAX_BACKOFF_TIME = 60
-MAX_PUSH_GATEWAY_RETRIES = 5
+MAX_AWS_RETRY_ATTEMPTS = 6
+
+# Limits of a single GetMetricData call
+MAX_METRIC_DATA_QUERIES = 500
+MAX_METRIC_DATAPOINTS = 100800
+
+# Page sizes of the EC2 describe paginators
+DESCRIBE_INSTANCES_PAGE_SIZE = 1000
+DESCRIBE_VOLUMES_PAGE_SIZE = 500
 
+# Disk metrics of the CloudWatch agent
+DISK_METRIC_NAMES = ("disk_total", "disk_used")
+
+# Number of threads for parallel per-instance AWS calls
+MAX_AWS_WORKERS = 16
+
+# Throttled calls are retried by botocore with client side rate limiting
+AWS_CLIENT_CONFIG = Config(
+    retries={"mode": "adaptive", "max_attempts": MAX_AWS_RETRY_ATTEMPTS},
+    max_pool_connections=MAX_AWS_WORKERS,
+)
 
+
+@lru_cache(maxsize=1)
 def get_aws_session():
     """
-    Create AWS session using environment variables or IAM role
+    Create AWS session using environment variables or IAM role. The session
+    is created once and shared by all clients.
     """
     # Try to get credentials from environment variables first
     aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
@@ -51,95 +72,132 @@ def get_aws_session():
     return session
 
 
+@lru_cache(maxsize=1)
 def get_cloudwatch_client():
     """
     Get CloudWatch client
     """
     session = get_aws_session()
-    return session.client("cloudwatch")
+    return session.client("cloudwatch", config=AWS_CLIENT_CONFIG)
 
 
+@lru_cache(maxsize=1)
 def get_ec2_client():
     """
     Get EC2 client
     """
     session = get_aws_session()
-    return session.client("ec2")
-
-
-def giveup_not_throttle_exception(ex: Exception) -> bool:
-    """
-    Function to give up retrying if the exception is not a throttle exception.
-    """
-    if isinstance(ex, ClientError):
-        error_code = ex.response.get("Error", {}).get("Code", "")
-        return error_code not in [
-            "Throttling", "RequestLimitExceeded", "ServiceUnavailable",
-        ]
-    return True
+    return session.client("ec2", config=AWS_CLIENT_CONFIG)
 
 
-@backoff.on_exception(
-    backoff.expo, ClientError, max_tries=MAX_BACKOFF_RETRIES,
-    max_time=MAX_BACKOFF_TIME, giveup=giveup_not_throttle_exception,
-    on_backoff=backoff_printer, on_giveup=giveup_printer,
-    raise_on_giveup=False, )
 def get_running_instances(ec2_client) -> List[Dict]:
     """
     Get all running EC2 instances
     """
-    response = ec2_client.describe_instances(
+    paginator = ec2_client.get_paginator("describe_instances")
+    pages = paginator.paginate(
         Filters=[{"Name": "instance-state-name", "Values": ["running"]}],
+        PaginationConfig={"PageSize": DESCRIBE_INSTANCES_PAGE_SIZE},
     )
 
-    instances = []
-    for reservation in response["Reservations"]:
+    # Keyed by instance id so that an instance is only listed once
+    instances = {}
+    for reservation in pages.search("Reservations[]"):
         for instance in reservation["Instances"]:
-            instance_info = {
+            instances[instance["InstanceId"]] = {
                 "InstanceId": instance["InstanceId"],
                 "InstanceType": instance["InstanceType"],
                 "LaunchTime": instance["LaunchTime"],
                 "AvailabilityZone": instance["Placement"]["AvailabilityZone"],
-                "Tags": {tag["Key"]: tag["Value"] for tag in instance.get(
-                    "Tags", [],
-                )},
+                # Only the Name tag is used for the metric labels
+                "Name": next((
+                    tag["Value"] for tag in instance.get("Tags", ())
+                    if tag["Key"] == "Name"), "unnamed"),
             }
-            instances.append(instance_info)
-
-    return instances
-
-
-@backoff.on_exception(
-    backoff.expo, ClientError, max_tries=MAX_BACKOFF_RETRIES,
-    max_time=MAX_BACKOFF_TIME, giveup=giveup_not_throttle_exception,
-    on_backoff=backoff_printer, on_giveup=giveup_printer,
-    raise_on_giveup=False, )
-def get_cloudwatch_metric(
-        cloudwatch_client, namespace: str, metric_name: str,
-        dimensions: List[Dict],
-        start_time: datetime, end_time: datetime, statistic: str = "Average",
-) -> Optional[float]:
-    """
-    Get CloudWatch metric data
-    """
-    response = cloudwatch_client.get_metric_statistics(
-        Namespace=namespace,
-        MetricName=metric_name,
-        Dimensions=dimensions,
-        StartTime=start_time,
-        EndTime=end_time,
-        Period=300,  # 5 minutes
-        Statistics=[statistic],
+
+    return list(instances.values())
+
+
+def add_metric_query(
+        metric_queries: List[Dict], namespace: str, metric_name: str,
+        dimensions: List[Dict], statistic: str = "Average",
+) -> str:
+    """
+    Add a CloudWatch metric to the batch query and return its query id
+    """
+    query_id = f"m{len(metric_queries)}"
+    metric_queries.append(
+        {
+            "Id": query_id,
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": namespace,
+                    "MetricName": metric_name,
+                    "Dimensions": dimensions,
+                },
+                "Period": 300,  # 5 minutes
+                "Stat": statistic,
+            },
+            "ReturnData": True,
+        },
     )
+    return query_id
 
-    if response["Datapoints"]:
-        # Get the latest datapoint
-        latest_datapoint = max(
-            response["Datapoints"], key=lambda x: x["Timestamp"],
-        )
-        return latest_datapoint[statistic]
 
-    return None
+def get_metric_data_batch(
+        cloudwatch_client, metric_queries: List[Dict], start_time: datetime,
+        end_time: datetime,
+) -> Dict[str, float]:
+    """
+    Execute the batch query and return the latest value for each query id
+    """
+    latest_values = {}
+    for offset in range(0, len(metric_queries), MAX_METRIC_DATA_QUERIES):
+        request = {
+            "MetricDataQueries": metric_queries[
+                offset:offset + MAX_METRIC_DATA_QUERIES],
+            "StartTime": start_time,
+            "EndTime": end_time,
+            "ScanBy": "TimestampDescending",
+            "MaxDatapoints": MAX_METRIC_DATAPOINTS,
+        }
+        while True:
+            response = cloudwatch_client.get_metric_data(**request)
+            for result in response["MetricDataResults"]:
+                # Values are newest first, keep the latest datapoint
+                if result["Values"]:
+                    latest_values.setdefault(
+                        result["Id"], result["Values"][0],
+                    )
+            if "NextToken" not in response:
+                break
+            request["NextToken"] = response["NextToken"]
+
+    return latest_values
+
+
+def set_pending_gauges(pending_gauges: List[Tuple[Gauge, Tuple, str]],
+                       metric_values: Dict[str, float]):
+    """
+    Update gauges with the values returned for their batch query ids. The
+    label values are given in the label order of the gauge.
+    """
+    for gauge, labels, query_id in pending_gauges:
+        value = metric_values.get(query_id)
+        if value is not None:
+            gauge.labels(*labels).set(value)
+
+
+def describe_instance_volumes(ec2_client, instance_id: str):
+    """
+    Iterate over all EBS volumes attached to an instance, page by page
+    """
+    paginator = ec2_client.get_paginator("describe_volumes")
+    pages = paginator.paginate(
+        Filters=[{"Name": "attachment.instance-id", "Values": [instance_id]}],
+        PaginationConfig={"PageSize": DESCRIBE_VOLUMES_PAGE_SIZE},
+    )
+    return pages.search("Volumes[]")
 
 
 def get_ebs_volumes_for_instance(ec2_client, instance_id: str) -> List[Dict]:
@@ -147,13 +205,8 @@ def get_ebs_volumes_for_instance(ec2_client, instance_id: str) -> List[Dict]:
     Get EBS volumes attached to an instance
     """
     try:
-        response = ec2_client.describe_volumes(
-            Filters=[
-                {"Name": "attachment.instance-id", "Values": [instance_id]}],
-        )
-
         volumes = []
-        for volume in response["Volumes"]:
+        for volume in describe_instance_volumes(ec2_client, instance_id):
             # Only include volumes that are attached
             if volume["State"] == "in-use":
                 volume_info = {
@@ -171,96 +224,82 @@ def get_ebs_volumes_for_instance(ec2_client, instance_id: str) -> List[Dict]:
         return []
 
 
+def get_instance_volume_data(
+        ec2_client, cloudwatch_client, instance_id: str, end_time: datetime,
+) -> Tuple[Dict, List[Dict]]:
+    """
+    Get disk metrics and attached EBS volumes of an instance
+    """
+    disk_details = get_enhanced_disk_metrics(
+        ec2_client, cloudwatch_client, instance_id, end_time,
+    )
+    volumes = get_ebs_volumes_for_instance(ec2_client, instance_id)
+    return disk_details, volumes
+
+
 def collect_ec2_instance_metrics(
         ec2_client, cloudwatch_client, instances: List[Dict],
         running_instances_gauge: Gauge, cpu_utilization_gauge: Gauge,
         memory_utilization_gauge: Gauge, network_in_gauge: Gauge,
-        network_out_gauge: Gauge,
+        network_out_gauge: Gauge, start_time: datetime, end_time: datetime,
 ):
     """
-    Collect EC2 instance metrics and update gauges
+    Collect EC2 instance metrics between start_time and end_time and update
+    gauges
     """
     print("Collecting EC2 instance metrics...")
 
     # Set total running instances count
     running_instances_gauge.set(len(instances))
 
-    end_time = datetime.utcnow()
-    start_time = end_time - timedelta(minutes=15)  # Last 15 minutes
-
-    processed_instances = set()  # Track processed instances to avoid
-    # duplicates
+    metric_queries = []
+    pending_gauges = []
 
     for instance in instances:
         instance_id = instance["InstanceId"]
-
-        # Skip if instance already processed (avoid duplicates)
-        if instance_id in processed_instances:
-            print(f"Skipping duplicate instance: {instance_id}")
-            continue
-
-        processed_instances.add(instance_id)
         instance_type = instance["InstanceType"]
         az = instance["AvailabilityZone"]
-        name = instance["Tags"].get("Name", "unnamed")
+        name = instance["Name"]
 
         print(f"Processing instance: {instance_id} ({name})")
 
         dimensions = [{"Name": "InstanceId", "Value": instance_id}]
+        labels = (instance_id, instance_type, az, name)
 
         # CPU Utilization
-        cpu_util = get_cloudwatch_metric(
-            cloudwatch_client, "AWS/EC2", "CPUUtilization", dimensions,
-            start_time,
-            end_time, "Average",
+        query_id = add_metric_query(
+            metric_queries, "AWS/EC2", "CPUUtilization", dimensions,
+            "Average",
         )
-        if cpu_util is not None:
-            cpu_utilization_gauge.labels(
-                instance_id=instance_id,
-                instance_type=instance_type,
-                availability_zone=az,
-                name=name,
-            ).set(cpu_util)
+        pending_gauges.append((cpu_utilization_gauge, labels, query_id))
 
         # Memory Utilization (requires CloudWatch agent)
-        memory_util = get_cloudwatch_metric(
-            cloudwatch_client, "CWAgent", "mem_used_percent", dimensions,
-            start_time,
-            end_time, "Average",
+        query_id = add_metric_query(
+            metric_queries, "CWAgent", "mem_used_percent", dimensions,
+            "Average",
         )
-        if memory_util is not None:
-            memory_utilization_gauge.labels(
-                instance_id=instance_id,
-                instance_type=instance_type,
-                availability_zone=az,
-                name=name,
-            ).set(memory_util)
+        pending_gauges.append((memory_utilization_gauge, labels, query_id))
 
         # Network In
-        network_in = get_cloudwatch_metric(
-            cloudwatch_client, "AWS/EC2", "NetworkIn", dimensions, start_time,
-            end_time, "Average",
+        query_id = add_metric_query(
+            metric_queries, "AWS/EC2", "NetworkIn", dimensions, "Average",
         )
-        if network_in is not None:
-            network_in_gauge.labels(
-                instance_id=instance_id,
-                instance_type=instance_type,
-                availability_zone=az,
-                name=name,
-            ).set(network_in)
+        pending_gauges.append((network_in_gauge, labels, query_id))
 
         # Network Out
-        network_out = get_cloudwatch_metric(
-            cloudwatch_client, "AWS/EC2", "NetworkOut", dimensions, start_time,
-            end_time, "Average",
+        query_id = add_metric_query(
+            metric_queries, "AWS/EC2", "NetworkOut", dimensions, "Average",
         )
-        if network_out is not None:
-            network_out_gauge.labels(
-                instance_id=instance_id,
-                instance_type=instance_type,
-                availability_zone=az,
-                name=name,
-            ).set(network_out)
+        pending_gauges.append((network_out_gauge, labels, query_id))
+
+    # Fetch all instance metrics with batched GetMetricData calls
+    try:
+        metric_values = get_metric_data_batch(
+            cloudwatch_client, metric_queries, start_time, end_time,
+        )
+        set_pending_gauges(pending_gauges, metric_values)
+    except ClientError as e:
+        print(f"Error collecting EC2 instance metrics: {e}")
 
 
 def collect_ebs_volume_metrics(
@@ -268,21 +307,30 @@ def collect_ebs_volume_metrics(
         volume_size_gauge: Gauge, volume_used_size_gauge: Gauge,
         volume_free_size_gauge: Gauge, volume_utilization_percent_gauge: Gauge,
         volume_iops_gauge: Gauge, volume_read_ops_gauge: Gauge,
-        volume_write_ops_gauge: Gauge,
+        volume_write_ops_gauge: Gauge, start_time: datetime,
+        end_time: datetime,
 ):
     """
-    Collect EBS volume metrics and update gauges
+    Collect EBS volume metrics between start_time and end_time and update
+    gauges
     """
     print("Collecting EBS volume metrics")
 
-    end_time = datetime.utcnow()
-    start_time = end_time - timedelta(minutes=15)  # Last 15 minutes
-
     processed_volumes = set()  # Track processed volumes to avoid duplicates
-
-    for instance in instances:
+    metric_queries = []
+    pending_gauges = []
+
+    # Fetch volume data of all instances in parallel, the gauges are only
+    # updated from this thread
+    with ThreadPoolExecutor(max_workers=MAX_AWS_WORKERS) as executor:
+        futures = [executor.submit(
+            get_instance_volume_data, ec2_client, cloudwatch_client,
+            instance["InstanceId"], end_time,
+        ) for instance in instances]
+
+    for instance, future in zip(instances, futures):
         instance_id = instance["InstanceId"]
-        instance_name = instance["Tags"].get("Name", "unnamed")
+        instance_name = instance["Name"]
 
         print(
             f"Processing EBS volumes for instance: {instance_id} ("
@@ -290,9 +338,7 @@ def collect_ebs_volume_metrics(
         )
 
         try:
-            disk_details = get_enhanced_disk_metrics(
-                ec2_client, cloudwatch_client, instance_id,
-            )
+            disk_details, volumes = future.result()
 
             if not disk_details:
                 print(
@@ -301,8 +347,6 @@ def collect_ebs_volume_metrics(
                     f"basic volume info",
                 )
                 # Fallback to basic volume information
-                volumes = get_ebs_volumes_for_instance(ec2_client, instance_id)
-
                 for volume in volumes:
                     volume_id = volume["VolumeId"]
                     if volume_id in processed_volumes:
@@ -311,14 +355,12 @@ def collect_ebs_volume_metrics(
                     processed_volumes.add(volume_id)
                     volume_type = volume["VolumeType"]
                     volume_size = volume["Size"]
+                    labels = (
+                        volume_id, instance_id, instance_name, volume_type,
+                    )
 
                     # Set basic volume info
-                    volume_size_gauge.labels(
-                        volume_id=volume_id,
-                        instance_id=instance_id,
-                        instance_name=instance_name,
-                        volume_type=volume_type,
-                    ).set(
+                    volume_size_gauge.labels(*labels).set(
                         volume_size,
                     )
 
@@ -327,30 +369,15 @@ def collect_ebs_volume_metrics(
                     estimated_free_gb = volume_size - estimated_used_gb
                     estimated_utilization = 50.0
 
-                    volume_used_size_gauge.labels(
-                        volume_id=volume_id,
-                        instance_id=instance_id,
-                        instance_name=instance_name,
-                        volume_type=volume_type,
-                    ).set(
+                    volume_used_size_gauge.labels(*labels).set(
                         estimated_used_gb,
                     )
 
-                    volume_free_size_gauge.labels(
-                        volume_id=volume_id,
-                        instance_id=instance_id,
-                        instance_name=instance_name,
-                        volume_type=volume_type,
-                    ).set(
+                    volume_free_size_gauge.labels(*labels).set(
                         estimated_free_gb,
                     )
 
-                    volume_utilization_percent_gauge.labels(
-                        volume_id=volume_id,
-                        instance_id=instance_id,
-                        instance_name=instance_name,
-                        volume_type=volume_type,
-                    ).set(
+                    volume_utilization_percent_gauge.labels(*labels).set(
                         estimated_utilization,
                     )
 
@@ -366,6 +393,7 @@ def collect_ebs_volume_metrics(
                 processed_volumes.add(volume_id)
                 volume_type = metrics["volume_type"]
                 volume_size = metrics["volume_size"]
+                labels = (volume_id, instance_id, instance_name, volume_type)
 
                 print(
                     f"Processing volume: {volume_id} (device: {device}) for "
@@ -374,39 +402,19 @@ def collect_ebs_volume_metrics(
                 )
 
                 # Set volume size
-                volume_size_gauge.labels(
-                    volume_id=volume_id,
-                    instance_id=instance_id,
-                    instance_name=instance_name,
-                    volume_type=volume_type,
-                ).set(
+                volume_size_gauge.labels(*labels).set(
                     volume_size,
                 )
 
-                volume_used_size_gauge.labels(
-                    volume_id=volume_id,
-                    instance_id=instance_id,
-                    instance_name=instance_name,
-                    volume_type=volume_type,
-                ).set(
+                volume_used_size_gauge.labels(*labels).set(
                     metrics["used_gb"],
                 )
 
-                volume_free_size_gauge.labels(
-                    volume_id=volume_id,
-                    instance_id=instance_id,
-                    instance_name=instance_name,
-                    volume_type=volume_type,
-                ).set(
+                volume_free_size_gauge.labels(*labels).set(
                     metrics["free_gb"],
                 )
 
-                volume_utilization_percent_gauge.labels(
-                    volume_id=volume_id,
-                    instance_id=instance_id,
-                    instance_name=instance_name,
-                    volume_type=volume_type,
-                ).set(
+                volume_utilization_percent_gauge.labels(*labels).set(
                     metrics["utilization_percent"],
                 )
 
@@ -418,59 +426,37 @@ def collect_ebs_volume_metrics(
 
             # Collect additional EBS metrics (IOPS, read/write ops) for all
             # volumes
-            volumes = get_ebs_volumes_for_instance(ec2_client, instance_id)
             for volume in volumes:
                 volume_id = volume["VolumeId"]
                 volume_type = volume["VolumeType"]
 
                 dimensions = [{"Name": "VolumeId", "Value": volume_id}]
+                labels = (volume_id, instance_id, instance_name, volume_type)
 
                 # Volume IOPS (Queue Length)
-                volume_iops = get_cloudwatch_metric(
-                    cloudwatch_client, "AWS/EBS", "VolumeQueueLength",
-                    dimensions,
-                    start_time, end_time, "Average",
+                query_id = add_metric_query(
+                    metric_queries, "AWS/EBS", "VolumeQueueLength",
+                    dimensions, "Average",
                 )
-                if volume_iops is not None:
-                    volume_iops_gauge.labels(
-                        volume_id=volume_id,
-                        instance_id=instance_id,
-                        instance_name=instance_name,
-                        volume_type=volume_type,
-                    ).set(
-                        volume_iops,
-                    )
+                pending_gauges.append((volume_iops_gauge, labels, query_id))
 
                 # Volume Read Operations
-                volume_read_ops = get_cloudwatch_metric(
-                    cloudwatch_client, "AWS/EBS", "VolumeReadOps", dimensions,
-                    start_time,
-                    end_time, "Sum",
+                query_id = add_metric_query(
+                    metric_queries, "AWS/EBS", "VolumeReadOps", dimensions,
+                    "Sum",
+                )
+                pending_gauges.append(
+                    (volume_read_ops_gauge, labels, query_id),
                 )
-                if volume_read_ops is not None:
-                    volume_read_ops_gauge.labels(
-                        volume_id=volume_id,
-                        instance_id=instance_id,
-                        instance_name=instance_name,
-                        volume_type=volume_type,
-                    ).set(
-                        volume_read_ops,
-                    )
 
                 # Volume Write Operations
-                volume_write_ops = get_cloudwatch_metric(
-                    cloudwatch_client, "AWS/EBS", "VolumeWriteOps", dimensions,
-                    start_time, end_time, "Sum",
+                query_id = add_metric_query(
+                    metric_queries, "AWS/EBS", "VolumeWriteOps", dimensions,
+                    "Sum",
+                )
+                pending_gauges.append(
+                    (volume_write_ops_gauge, labels, query_id),
                 )
-                if volume_write_ops is not None:
-                    volume_write_ops_gauge.labels(
-                        volume_id=volume_id,
-                        instance_id=instance_id,
-                        instance_name=instance_name,
-                        volume_type=volume_type,
-                    ).set(
-                        volume_write_ops,
-                    )
 
         except Exception as e:
             print(
@@ -479,36 +465,54 @@ def collect_ebs_volume_metrics(
             )
             continue
 
+    # Fetch IOPS and read/write ops of all volumes with batched GetMetricData
+    # calls
+    try:
+        metric_values = get_metric_data_batch(
+            cloudwatch_client, metric_queries, start_time, end_time,
+        )
+        set_pending_gauges(pending_gauges, metric_values)
+    except Exception as e:
+        print(f"Error collecting EBS volume IOPS metrics: {e}")
+
 
 def get_size_gb(size_bytes: int) -> float:
     """Convert bytes to GB"""
     return size_bytes / (1024 * 1024 * 1024)
 
 
-def get_metric_data_enhanced(
-        cloudwatch_client, today_obj: datetime, yesterday_obj: datetime,
-        instance_id: str,
-):
+def get_disk_metrics(cloudwatch_client, instance_id: str) -> Dict[str, Dict]:
     """
-    Enhanced method to get disk metrics using batch queries
+    Get disk_total and disk_used metrics of an instance, listed with a
+    single call.
     """
-    # Get disk total metrics
-    disk_total_metrics = cloudwatch_client.list_metrics(
+    disk_metrics = {
+        metric_name: {"Metrics": []} for metric_name in DISK_METRIC_NAMES
+    }
+    paginator = cloudwatch_client.get_paginator("list_metrics")
+    pages = paginator.paginate(
         Namespace="CWAgent",
-        MetricName="disk_total",
         Dimensions=[
             {"Name": "InstanceId", "Value": instance_id},
         ],
     )
+    for metric in pages.search("Metrics[]"):
+        if metric["MetricName"] in disk_metrics:
+            disk_metrics[metric["MetricName"]]["Metrics"].append(metric)
 
-    # Get disk used metrics
-    disk_used_metrics = cloudwatch_client.list_metrics(
-        Namespace="CWAgent",
-        MetricName="disk_used",
-        Dimensions=[
-            {"Name": "InstanceId", "Value": instance_id},
-        ],
-    )
+    return disk_metrics
+
+
+def get_metric_data_enhanced(
+        cloudwatch_client, today_obj: datetime, yesterday_obj: datetime,
+        instance_id: str,
+):
+    """
+    Enhanced method to get disk metrics using batch queries
+    """
+    disk_metrics = get_disk_metrics(cloudwatch_client, instance_id)
+    disk_total_metrics = disk_metrics["disk_total"]
+    disk_used_metrics = disk_metrics["disk_used"]
 
     metric_query = []
     device_names = set()
@@ -558,27 +562,24 @@ def add_dev_to_query(disk_metrics, metric_query, metric_name):
     return metric_query, devices
 
 
-def find_closest_volume(volume_size: float, volumes_response: dict):
+def find_closest_volume(volume_size: float, sorted_volumes: List[Dict],
+                        volume_sizes: List[float]):
     """
-    Find the closest volume by size to match disk metrics to actual volumes
+    Find the closest volume by size to match disk metrics to actual volumes.
+    The volumes must be sorted by size, with volume_sizes holding their sizes.
     """
-    closest_vol = None
-    closest_diff = float("inf")
-
-    for vol in volumes_response["Volumes"]:
-        diff = vol["Size"] - volume_size
-        if 0 <= diff < closest_diff:
-            closest_vol = vol
-            closest_diff = diff
-
-    return closest_vol
+    # Smallest volume which is not smaller than the disk
+    idx = bisect.bisect_left(volume_sizes, volume_size)
+    return sorted_volumes[idx] if idx < len(sorted_volumes) else None
 
 
-def get_enhanced_disk_metrics(ec2_client, cloudwatch_client, instance_id: str):
+def get_enhanced_disk_metrics(ec2_client, cloudwatch_client, instance_id: str,
+                              end_time: datetime):
     """
-    Returns structured data with volume mapping
+    Returns structured data with volume mapping, based on the disk metrics
+    of the day before end_time
     """
-    today_obj = datetime.utcnow()
+    today_obj = end_time
     yesterday_obj = today_obj - timedelta(days=1)
 
     # Get metric data using enhanced approach
@@ -590,22 +591,23 @@ def get_enhanced_disk_metrics(ec2_client, cloudwatch_client, instance_id: str):
         return {}
 
     # Get volumes for this instance
-    volumes_response = ec2_client.describe_volumes(
-        Filters=[{"Name": "attachment.instance-id", "Values": [instance_id]}],
+    sorted_volumes = sorted(
+        describe_instance_volumes(ec2_client, instance_id),
+        key=itemgetter("Size"),
     )
+    volume_sizes = [vol["Size"] for vol in sorted_volumes]
+
+    # Maximum value of each query, by query id
+    max_values = {
+        result["Id"]: int(max(result["Values"]))
+        for result in response["MetricDataResults"] if result["Values"]
+    }
 
     disk_details = {}
 
     for device in device_names:
-        total_size = -1
-        used_size = -1
-
-        if response["MetricDataResults"]:
-            for result in response["MetricDataResults"]:
-                if result["Id"] == f"disk_total_{device}" and result["Values"]:
-                    total_size = int(max(result["Values"]))
-                if result["Id"] == f"disk_used_{device}" and result["Values"]:
-                    used_size = int(max(result["Values"]))
+        total_size = max_values.get(f"disk_total_{device}", -1)
+        used_size = max_values.get(f"disk_used_{device}", -1)
 
         if total_size > 0:
             total_size_gb = get_size_gb(total_size)
@@ -615,7 +617,9 @@ def get_enhanced_disk_metrics(ec2_client, cloudwatch_client, instance_id: str):
                             ) if used_size > 0 else total_size_gb)
 
             # Find matching volume
-            vol = find_closest_volume(total_size_gb, volumes_response)
+            vol = find_closest_volume(
+                total_size_gb, sorted_volumes, volume_sizes,
+            )
 
             if vol:
                 disk_details[device] = {
@@ -12,99 +12,185 @@
 # - Number of projects using each release
 # -----------------------------------------------------------------------------
 
-from collections import defaultdict
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 
 from ibm_cloud_sdk_core import ApiException
 from ibmcloudant import CloudantV1
-from sw360_dashboard.couchdb_utils import CLOUDANT_LIMIT_MAX
+from sw360_dashboard.couchdb_utils import save_new_view, fetch_results, \
+    count_by_type_view
+
+# Number of documents fetched per request
+DOCS_PAGE_SIZE = 2000
+
+# Only the fields used downstream are kept of each document
+Component = namedtuple('Component', 'id name type createdOn createdBy')
+Release = namedtuple('Release',
+                     'id name version componentId createdOn createdBy')
+ProjectUsage = namedtuple('ProjectUsage', 'project_id project_name')
 
 # ----------------------------------------
-# queries
+# views
 # ----------------------------------------
 
-# Get all components
-get_all_components_query = {"selector": {"type": {"$eq": "component"}},
-                            "limit": 999999}
+# The views are kept in the dashboard's own design document, changing one of
+# SW360's design documents would rebuild all of its views
+DESIGN_DOC = "Common"
 
-# Get all releases
-get_all_releases_query = {"selector": {"type": {"$eq": "release"}},
-                          "limit": 999999}
+# Projects using each release, reduced to the number of projects per release
+RELEASE_USAGE_VIEW = "byReleaseUsage"
+release_usage_map_function = {
+    "map": "function(doc) {"
+           "  if (doc.type == 'project' && doc.releaseIdToUsage) {"
+           "    for (var releaseId in doc.releaseIdToUsage) {"
+           "      emit(releaseId, {'id': doc._id,"
+           " 'name': doc.name || 'Unknown'});"
+           "    }"
+           "  }"
+           "}",
+    "reduce": "_count",
+}
 
-# Get all projects with releaseIdToUsage field
-get_all_projects_query = {"selector": {"type": {"$eq": "project"}},
-                          "limit": 999999}
+# Fields of each release used by the report, by component id, so the
+# release documents themselves are not transferred
+RELEASES_BY_COMPONENT_VIEW = "fieldsByComponentId"
+releases_by_component_map_function = {
+    "map": "function(doc) {"
+           "  if (doc.type == 'release') {"
+           "    emit(doc.componentId || null, ["
+           "      'name' in doc ? doc.name : 'Unknown',"
+           "      'version' in doc ? doc.version : 'Unknown',"
+           "      'createdOn' in doc ? doc.createdOn : '',"
+           "      'createdBy' in doc ? doc.createdBy : '']);"
+           "  }"
+           "}",
+}
 
 
 # ---------------------------------------
 # functions
 # ---------------------------------------
 
+def to_component(doc):
+    return Component(doc['_id'], doc.get('name', 'Unknown'),
+                     doc.get('componentType', 'Unknown'),
+                     doc.get('createdOn', ''), doc.get('createdBy', ''))
+
+
+def fetch_docs_of_type(client: CloudantV1, database: str, doc_type: str,
+                       convert) -> list:
+    """
+    Get the documents of one type, by their key range in the view of
+    documents by type, in the order of their ids. The documents are
+    projected to narrow tuples as they are read, the full documents are not
+    kept.
+    """
+    design_doc, view, _ = count_by_type_view
+    return [convert(row['doc']) for row in fetch_results(
+        client, database, design_doc, view, page_size=DOCS_PAGE_SIZE,
+        start_key=doc_type, end_key=doc_type, reduce=False,
+        include_docs=True) if row.get('doc')]
+
+
+def fetch_releases(client: CloudantV1, database: str) -> list:
+    """Get the releases grouped by component, in the order of their ids"""
+    releases = []
+    append_release = releases.append
+    for row in fetch_results(client, database, DESIGN_DOC,
+                             RELEASES_BY_COMPONENT_VIEW):
+        name, version, created_on, created_by = row['value']
+        append_release(Release(row['id'], name, version, row['key'],
+                               created_on, created_by))
+    return releases
+
+
+def count_docs_of_type(client: CloudantV1, database: str,
+                       doc_type: str) -> int:
+    """Get the number of documents of one type, counted by CouchDB"""
+    design_doc, view, _ = count_by_type_view
+    row = next(fetch_results(client, database, design_doc, view,
+                             key=doc_type), None)
+    return row['value'] if row else 0
+
+
 def get_all_data(client: CloudantV1, database: str):
-    """Retrieve all components, releases, and projects from the database"""
-    components, releases, projects = [], [], []
-
-    print('Fetching all components...')
-    try:
-        db_query = client.post_find(
-            database, get_all_components_query,
-            limit=CLOUDANT_LIMIT_MAX,
-        ).get_result()
-        components = list(db_query["docs"])
-    except ApiException as ex:
-        print(f"Error: {ex}")
-    print(f'Retrieved {len(components)} components')
+    """
+    Retrieve all components and releases from the database, and the number
+    of projects
+    """
+    design_doc, view, map_function = count_by_type_view
+    save_new_view(client, database, design_doc, view, map_function)
+    save_new_view(client, database, DESIGN_DOC,
+                  RELEASES_BY_COMPONENT_VIEW,
+                  releases_by_component_map_function)
 
-    print('Fetching all releases...')
-    try:
-        db_query = client.post_find(
-            database, get_all_releases_query,
-            limit=CLOUDANT_LIMIT_MAX,
-        ).get_result()
-        releases = list(db_query["docs"])
-    except ApiException as ex:
-        print(f"Error: {ex}")
+    print('Fetching all components, releases and projects...')
+    # The reads are independent, they run in parallel on the client's pool
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [
+            executor.submit(fetch_docs_of_type, client, database,
+                            'component', to_component),
+            executor.submit(fetch_releases, client, database),
+            executor.submit(count_docs_of_type, client, database, 'project'),
+        ]
+    results = []
+    for future, default in zip(futures, ([], [], 0)):
+        try:
+            results.append(future.result())
+        except ApiException as ex:
+            print(f"Error: {ex}")
+            results.append(default)
+    components, releases, projects_count = results
+    print(f'Retrieved {len(components)} components')
     print(f'Retrieved {len(releases)} releases')
+    print(f'Counted {projects_count} projects')
 
-    print('Fetching all projects...')
-    try:
-        db_query = client.post_find(
-            database, get_all_projects_query,
-            limit=CLOUDANT_LIMIT_MAX,
-        ).get_result()
-        projects = list(db_query["docs"])
-    except ApiException as ex:
-        print(f"Error: {ex}")
-    print(f'Retrieved {len(projects)} projects')
-
-    return components, releases, projects
+    return components, releases, projects_count
 
 
 def build_release_component_mapping(releases):
     """Build a mapping from release ID to component ID"""
-    release_to_component = {}
-    for release in releases:
-        release_id = release.get('_id')
-        component_id = release.get('componentId')
-        if release_id and component_id:
-            release_to_component[release_id] = component_id
-    return release_to_component
-
-
-def count_projects_per_release(projects):
-    """Count how many projects use each release and collect project names"""
-    release_project_count = defaultdict(int)
+    # hot loop: a comprehension instead of repeated dict assignments
+    return {
+        release.id: release.componentId
+        for release in releases
+        if release.id and release.componentId
+    }
+
+
+def count_projects_per_release(client: CloudantV1, database: str,
+                               with_names: bool = True):
+    """
+    Count how many projects use each release and collect project names
+    :param with_names: Collect the names of the projects, skipping the read
+        of every project usage if they are not needed
+    :raises ApiException: If a page of the view cannot be read, so partial
+        counts are never returned
+    """
+    release_project_count = {}
     release_project_names = defaultdict(list)
 
-    for project in projects:
-        project_id = project.get('_id')
-        project_name = project.get('name', 'Unknown')
+    save_new_view(client, database, DESIGN_DOC, RELEASE_USAGE_VIEW,
+                  release_usage_map_function)
 
-        # Check releaseIdToUsage field
-        if 'releaseIdToUsage' in project and project['releaseIdToUsage']:
-            for release_id in project['releaseIdToUsage'].keys():
-                release_project_count[release_id] += 1
-                release_project_names[release_id].append(
-                    {'project_id': project_id, 'project_name': project_name}, )
+    # Number of projects per release, reduced by CouchDB
+    release_project_count.update(
+        (row['key'], row['value']) for row in fetch_results(
+            client, database, DESIGN_DOC, RELEASE_USAGE_VIEW, group=True))
+
+    if not with_names:
+        return release_project_count, release_project_names
+
+    # Projects linked to each release
+    # hot loop: bound methods are looked up once, one small tuple is kept per
+    # project usage
+    names_of = release_project_names.__getitem__
+    for row in fetch_results(client, database, DESIGN_DOC,
+                             RELEASE_USAGE_VIEW, reduce=False):
+        value = row['value']
+        names_of(row['key']).append(ProjectUsage(value['id'], value['name']))
 
     return release_project_count, release_project_names
 
@@ -112,57 +198,68 @@ def count_projects_per_release(projects):
 def organize_data(components, releases, release_project_count,
                   release_project_names, release_to_component, ):
     """Organize data by component -> releases -> project count"""
-    # Create component lookup
-    component_lookup = {comp['_id']: comp for comp in components}
-
-    # Group releases by component
-    component_releases = defaultdict(list)
+    # Group releases by component as compact tuples, the negated project
+    # count first so a plain sort orders them by count and then by name
+    # (the position keeps the order of releases with the same count and name)
+    component_releases = {component.id: [] for component in components}
     orphaned_releases = []
 
-    for release in releases:
-        component_id = release.get('componentId')
-        if component_id and component_id in component_lookup:
-            component_releases[component_id].append(release)
-        else:
-            orphaned_releases.append(release)
+    # hot loop: bound methods are looked up once
+    releases_of = component_releases.get
+    orphaned_append = orphaned_releases.append
+    project_count_of = release_project_count.get
+    for position, release in enumerate(releases):
+        # Releases without component or of a missing component are orphans
+        release_tuples = releases_of(release.componentId)
+        if release_tuples is None:
+            orphaned_append(release)
+            continue
+        release_id = release.id
+        release_tuples.append((
+            -project_count_of(release_id, 0),
+            release.name,
+            position,
+            release_id,
+            release.version,
+            release.createdOn,
+            release.createdBy,
+        ))
 
     # Build final data structure
     result = []
+    result_append = result.append
+    pop_releases = component_releases.pop
+    project_names_of = release_project_names.get
 
     for component in components:
-        component_id = component['_id']
-        component_data = {
+        component_id = component.id
+        release_tuples = pop_releases(component_id, [])
+        release_tuples.sort()
+        # The releases with projects come first, their negated counts are < 0
+        releases_with_projects = bisect_left(release_tuples, (0,))
+
+        result_append({
             'component_id': component_id,
-            'component_name': component.get('name', 'Unknown'),
-            'component_type': component.get('componentType', 'Unknown'),
-            'component_created_on': component.get('createdOn', ''),
-            'component_created_by': component.get('createdBy', ''),
-            'total_releases': len(component_releases[component_id]),
-            'releases': []
-        }
-
-        for release in component_releases[component_id]:
-            release_id = release['_id']
-            project_count = release_project_count.get(release_id, 0)
-            projects_list = release_project_names.get(release_id, [])
-
-            release_data = {
+            'component_name': component.name,
+            'component_type': component.type,
+            'component_created_on': component.createdOn,
+            'component_created_by': component.createdBy,
+            'total_releases': len(release_tuples),
+            'releases_with_projects': releases_with_projects,
+            'releases': [{
                 'release_id': release_id,
-                'release_name': release.get('name', 'Unknown'),
-                'release_version': release.get('version', 'Unknown'),
-                'release_created_on': release.get('createdOn', ''),
-                'release_created_by': release.get('createdBy', ''),
-                'project_count': project_count,
-                'projects': projects_list
-            }
-            component_data['releases'].append(release_data)
-
-        # Sort releases by project count (descending) and then by name
-        component_data['releases'].sort(
-            key=lambda x: (-x['project_count'], x['release_name']), )
-        result.append(component_data)
+                'release_name': name,
+                'release_version': version,
+                'release_created_on': created_on,
+                'release_created_by': created_by,
+                'project_count': -neg_count,
+                'projects': project_names_of(release_id, []),
+            } for neg_count, name, _, release_id, version, created_on,
+                created_by in release_tuples],
+        })
 
     # Sort components by total releases (descending) and then by name
-    result.sort(key=lambda x: (-x['total_releases'], x['component_name']))
+    result.sort(key=itemgetter('component_name'))
+    result.sort(key=itemgetter('total_releases'), reverse=True)
 
     return result, orphaned_releases
@@ -12,7 +12,7 @@ import time
 
 from ibmcloudant import CloudantV1
 from prometheus_client import (
-    CollectorRegistry, Gauge, push_to_gateway, delete_from_gateway,
+    CollectorRegistry, Gauge, delete_from_gateway,
 )
 from src.sw360_dashboard.collect_components_releases_projects_data import (
     get_all_data, build_release_component_mapping, count_projects_per_release,
@@ -20,6 +20,7 @@ from src.sw360_dashboard.collect_components_releases_projects_data import (
 )
 from sw360_dashboard.couchdb_utils import (
     get_pushgateway_url, get_cloudant_client, get_sw360_db_name, push_metrics,
+    set_gauge_values, pushgateway_handler,
 )
 
 # Define Prometheus Gauges for Components, Releases, and Projects metrics
@@ -113,8 +114,9 @@ def update_component_type_metrics(organized_data):
         comp_type = component['component_type'] or 'Unknown'
         type_counts[comp_type] = type_counts.get(comp_type, 0) + 1
 
-    for comp_type, count in type_counts.items():
-        components_by_type_gauge.labels(component_type=comp_type).set(count)
+    components_by_type_gauge.clear()
+    set_gauge_values(components_by_type_gauge, [
+        ((comp_type,), count) for comp_type, count in type_counts.items()])
 
 
 def update_time_based_metrics(organized_data):
@@ -135,37 +137,43 @@ def update_time_based_metrics(organized_data):
                 release_years[rel_year] = release_years.get(rel_year, 0) + 1
 
     # Set component metrics by year
-    for year, count in component_years.items():
-        components_created_per_year_gauge.labels(year=str(year)).set(count)
+    components_created_per_year_gauge.clear()
+    set_gauge_values(components_created_per_year_gauge, [
+        ((str(year),), count) for year, count in component_years.items()])
 
     # Set release metrics by year
-    for year, count in release_years.items():
-        releases_created_per_year_gauge.labels(year=str(year)).set(count)
+    releases_created_per_year_gauge.clear()
+    set_gauge_values(releases_created_per_year_gauge, [
+        ((str(year),), count) for year, count in release_years.items()])
 
 
 def update_detailed_metrics(organized_data):
     """Update detailed metrics for components and releases"""
+    component_release_counts = []
+    release_project_counts = []
     for component in organized_data:
-        comp_id = component['component_id']
         comp_name = component['component_name']
-        comp_type = component['component_type'] or 'Unknown'
-        release_count = component['total_releases']
 
-        # Set component release count
-        component_release_count_gauge.labels(
-            component_id=comp_id,
-            component_name=comp_name,
-            component_type=comp_type,
-        ).set(release_count)
+        # Component release count
+        component_release_counts.append((
+            (component['component_id'], comp_name,
+             component['component_type'] or 'Unknown'),
+            component['total_releases'],
+        ))
+
+        # Release project counts
+        release_project_counts.extend(
+            ((release['release_id'], release['release_name'],
+              release['release_version'], comp_name),
+             release['project_count'])
+            for release in component['releases']
+        )
 
-        # Set release project counts
-        for release in component['releases']:
-            release_project_count_gauge.labels(
-                release_id=release['release_id'],
-                release_name=release['release_name'],
-                release_version=release['release_version'],
-                component_name=comp_name,
-            ).set(release['project_count'])
+    # Drop children of a previous run, they may no longer exist
+    component_release_count_gauge.clear()
+    release_project_count_gauge.clear()
+    set_gauge_values(component_release_count_gauge, component_release_counts)
+    set_gauge_values(release_project_count_gauge, release_project_counts)
 
 
 def collect_and_export_metrics(client: CloudantV1, database: str):
@@ -173,14 +181,16 @@ def collect_and_export_metrics(client: CloudantV1, database: str):
     print('Starting Components, Releases, and Projects metrics collection...')
 
     # Get all data
-    components, releases, projects = get_all_data(client, database)
+    components, releases, total_projects_count = get_all_data(
+        client, database,
+    )
 
     # Build mappings
     release_to_component = build_release_component_mapping(releases)
 
-    # Count projects per release
+    # Count projects per release, the project names are not exported
     release_project_count, release_project_names = count_projects_per_release(
-        projects,
+        client, database, with_names=False,
     )
 
     # Organize data
@@ -191,18 +201,15 @@ def collect_and_export_metrics(client: CloudantV1, database: str):
 
     # Calculate summary statistics
     total_components = len(organized_data)
-    total_releases = sum(c['total_releases'] for c in organized_data)
-    total_projects_count = len(projects)
-    components_with_releases = len(
-        [c for c in organized_data if c['total_releases'] > 0],
-    )
+    # One pass over the components for all the counts
+    total_releases = components_with_releases = releases_with_projects = 0
+    for component in organized_data:
+        component_releases = component['total_releases']
+        if component_releases:
+            total_releases += component_releases
+            components_with_releases += 1
+            releases_with_projects += component['releases_with_projects']
     components_without_releases = total_components - components_with_releases
-    releases_with_projects = sum(
-        1
-        for c in organized_data
-        for r in c['releases']
-        if r['project_count'] > 0
-    )
     releases_without_projects = total_releases - releases_with_projects
     orphaned_releases_count = len(orphaned_releases)
 
@@ -233,13 +240,6 @@ def collect_and_export_metrics(client: CloudantV1, database: str):
     print(f'  - Releases with projects: {releases_with_projects}')
     print(f'  - Orphaned releases: {orphaned_releases_count}')
 
-    # Push metrics to Prometheus
-    push_to_gateway(
-        get_pushgateway_url(), job='crp_exporter',
-        registry=registry, grouping_key={'instance': 'latest'},
-    )
-    print('Metrics pushed to Prometheus Push Gateway successfully!')
-
 
 def main():
     """Main execution function"""
@@ -249,9 +249,12 @@ def main():
     collect_and_export_metrics(client, sw360_db)
 
     print("Code executed")
-    delete_from_gateway(get_pushgateway_url(), job='couchdb_exporter',
-                        grouping_key={'instance': 'latest'})
-    push_metrics('couchdb_exporter', registry)
+    # Push once to the own job, the job of the common metrics is left alone
+    delete_from_gateway(get_pushgateway_url(), job='crp_exporter',
+                        grouping_key={'instance': 'latest'},
+                        handler=pushgateway_handler)
+    push_metrics(registry, 'crp_exporter')
+    print('Metrics pushed to Prometheus Push Gateway successfully!')
     print("\n Execution ended for exporter ............")
 
 
@@ -6,18 +6,25 @@
 #
 # This script is for fetching overall stats for SW360.
 
+import argparse
 import time
-from collections import Counter
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import itemgetter
 
-from ibm_cloud_sdk_core import ApiException
 from ibmcloudant import CloudantV1
-from prometheus_client import CollectorRegistry, Gauge, delete_from_gateway
+from prometheus_client import CollectorRegistry, Gauge, start_http_server
 
 from .couchdb_utils import get_cloudant_client, get_sw360_db_name, \
-    get_attachment_db_name, fetch_results, save_new_view, \
-    format_for_time_series, push_metrics, query_execution_component_by_type, \
-    get_pushgateway_url
+    get_attachment_db_name, fetch_results, push_registry, wait_for_query, \
+    query_execution_component_by_type, \
+    set_gauge_values, fetch_unused_releases, ensure_views, \
+    release_usage_design_doc, release_usage_view, release_usage_map_function, \
+    count_by_type_view, \
+    get_metrics_port, get_metrics_refresh_seconds
+
+# Number of queries executed in parallel
+MAX_QUERY_WORKERS = 6
 
 # Define Prometheus Gauges for each metric
 registry = CollectorRegistry()
@@ -71,362 +78,365 @@ attachment_usage_group = Gauge(
     ['group'], registry=registry)
 
 
-# --------Common methods---------------
-def count_documents_in_view(client: CloudantV1, database: str, design_doc: str,
-                            view_name: str) -> int:
-    """
-    Function to get count of documents/rows in a given view of a design
-    document.
-    :param client: Cloudant client
-    :param database: Name of the database
-    :param design_doc: name of design doc
-    :param view_name: name of view
-    :return: count of documents in the view
-    """
-    try:
-        response = client.post_view(
-            db=database, ddoc=design_doc, view=view_name,
-            include_docs=False, limit=1).get_result()
-    except ApiException as ex:
-        print("Error getting count of documents from "
-              f"'{design_doc}/{view_name}': {ex}")
-        return 0
-    return int(response['total_rows'])
+# ----------------------------Views-------------------------------------------
+# (design document, view, map/reduce functions) of the views read by the
+# queries, created once by ensure_views before the queries run. New views go
+# to the dashboard's own design document, changing one of SW360's design
+# documents would rebuild all of its views
+
+# One value per document, the summed length of its attachments
+attachment_length_view = ("Common", "totalAttachmentLength", {
+    "map": "function(doc) {"
+           "  if (doc.type === 'attachment' && doc._attachments) {"
+           "    var length = 0;"
+           "    for (var key in doc._attachments) {"
+           "      length += doc._attachments[key].length;"
+           "    }"
+           "    emit(null, length);"
+           "  }"
+           "}",
+    "reduce": "_sum"})
+
+# Number of documents per creation year and type
+count_by_year_and_type_view = ("Common", "countByYearAndType", {
+    'map': "function(doc) {"
+           "  if ((doc.type == 'component' || doc.type == 'project'"
+           "       || doc.type == 'release') && doc.createdOn) {"
+           "    emit([doc.createdOn.substring(0, 4), doc.type], null);"
+           "  }"
+           "}",
+    'reduce': "_count"})
+
+# Number of releases per component type and ECC status
+count_by_type_and_ecc_status_view = (
+    "Common", "countByComponentTypeAndECCStatus", {'map': """
+    function(doc) {
+        if (doc.type === 'release' && doc.eccInformation) {
+            var eccStatus = doc.eccInformation.eccStatus || 'UNKNOWN';
+            var componentType = doc.componentType || 'UNKNOWN';
+            emit([componentType, eccStatus], null);
+        }
+    }
+    """, 'reduce': "_count"})
+
+# Number of releases per component and release name
+count_by_component_view = ("Common", "countByComponentIdAndName", {
+    'map': "function(doc) {  if (doc.type == 'release') {"
+           "  emit([doc.componentId, doc.name], null) }}",
+    'reduce': "_count"})
+
+# Number of releases per ECC status, component and release name
+count_by_ecc_status_and_component_view = (
+    "Common", "countByECCStatusComponentIdAndName", {'map': """
+    function(doc) {
+        if (doc.type === 'release' && doc.eccInformation) {
+            var eccStatus = doc.eccInformation.eccStatus || 'UNKNOWN';
+            var componentName = doc.name || 'UNKNOWN';
+            emit([eccStatus, doc.componentId, componentName], null);
+        }
+    }
+    """, 'reduce': "_count"})
+
+# Number of components per main license
+count_by_license_view = ("Common", "countByMainLicenseId", {
+    'map': "function(doc) { if (doc.type == 'component') {"
+           " if(doc.mainLicenseIds) { for(var i in doc.mainLicenseIds){"
+           "  emit(doc.mainLicenseIds[i], null); }}"
+           " else { emit('EMPTY', null); } } }",
+    'reduce': "_count"})
+
+# Components by type, counted per type by query_execution_component_by_type
+component_type_view = ("Component", "bycomponenttype", {
+    'map': "function(doc) {"
+           " if (doc.type == 'component') {"
+           "  emit(doc.componentType, doc._id);"
+           " }"
+           "}"})
+
+sw360_views = [
+    count_by_type_view, count_by_year_and_type_view,
+    count_by_type_and_ecc_status_view, count_by_component_view,
+    count_by_ecc_status_and_component_view, count_by_license_view,
+    component_type_view,
+    (release_usage_design_doc, release_usage_view,
+     release_usage_map_function),
+]
+attachment_views = [attachment_length_view]
 
 
 # ---------------Counting total number of comp, proj, rel----------------------
 def query_execution_count_all(client: CloudantV1, database: str):
     print('\nExecuting the query for counting total number of comp, proj,'
           ' rel.................../')
-    data = []
+    design_doc, view, _ = count_by_type_view
 
-    # Counting total components, projects and releases
-    design_doc_arr = {
-        "Components": "Component", "Projects": "Project",
-        "Releases": "Release"}
-
-    for key, design_doc in design_doc_arr.items():
-        item_count = count_documents_in_view(
-            client, database, design_doc, "all")
-        data.append({"type": key, "value": item_count})
+    # Number of documents of each type, one row per type
+    type_count = {row["key"]: row["value"] for row in fetch_results(
+        client, database, design_doc, view, group=True)}
 
     # Update Prometheus metrics
-    for entry in data:
-        if entry["type"] == "Projects":
-            projects_count.set(entry["value"])
-        elif entry["type"] == "Releases":
-            releases_count.set(entry["value"])
-        elif entry["type"] == "Components":
-            components_count_total.set(entry["value"])
+    projects_count.set(type_count.get("project", 0))
+    releases_count.set(type_count.get("release", 0))
+    components_count_total.set(type_count.get("component", 0))
 
 
 # ----------------------Attachment Disk Usage Total----------------------------
 def query_execution_attachment_usage_all(client: CloudantV1, database: str):
     print('\nExecuting the query for getting total attachment disk'
           ' usage.................../')
-    design_doc = "AttachmentContent"
-    view = "totalDiskUsage"
-    map_function = {
-        "map": "function(doc) {"
-               "  if (doc.type === 'attachment' && doc._attachments) {"
-               "    for (var key in doc._attachments) {"
-               "      emit(doc._id, doc._attachments[key].length);"
-               "    }"
-               "  }"
-               "}", "reduce": "_stats"}
-
-    # Ensure the view is created
-    save_new_view(client, database, design_doc, view, map_function)
-
-    # Fetch results from the view
-    result = fetch_results(client, database, design_doc, view)
-
-    if not result:
-        print("No results found for the view.")
-        return
+    design_doc, view, _ = attachment_length_view
 
-    total_length = 0
-    item_count = 0
+    # Fetch the total from the view
+    row = next(fetch_results(client, database, design_doc, view), None)
 
-    for row in result:
-        if ('value' in row and 'sum' in row['value'] and 'count'
-                in row['value']):
-            total_length += row['value']['sum']
-            item_count += row['value']['count']
+    if row is None:
+        print("No results found for the view.")
+        return
 
     # Update Prometheus metrics
-    attachment_count.set(total_length)
+    attachment_count.set(row["value"])
 
 
 def query_comp_proj_rel_time_series_execution(client: CloudantV1,
                                               database: str):
     print('\nExecuting the time-series query.................../')
-    print('\n  Executing the time-series query for projects................./')
-
-    design_doc_arr = {"Component": {"ddoc": "Component", "type": "component"},
-                      "Project": {"ddoc": "Project", "type": "project"},
-                      "Release": {"ddoc": "Release", "type": "release"}}
-    combined_data = {}
-    for key, view_info in design_doc_arr.items():
-        map_function = {"map": "function(doc) {"
-                               f"  if (doc.type == '{view_info['type']}') {{"
-                               "    emit(doc.createdOn, doc._id);"
-                               "  }"
-                               "}"}
-        save_new_view(client, database, view_info["ddoc"],
-                      "byCreatedOn", map_function)
-        result = fetch_results(client, database, view_info["ddoc"],
-                               "byCreatedOn")
-        if result is None:
-            result = []
-        data = format_for_time_series(result, key)
-        for data_obj in data:
-            year = data_obj["Year"]
-            if year not in combined_data:
-                combined_data[year] = {"Year": year}
-            combined_data[year].update(data_obj)
-
-    for year, metrics in combined_data.items():
-        Projects.labels(year=year).set(metrics.get("Project", 0))
-        Components.labels(year=year).set(metrics.get("Component", 0))
-        Releases.labels(year=year).set(metrics.get("Release", 0))
+    design_doc, view, _ = count_by_year_and_type_view
+
+    # Number of documents per creation year and type, one row per pair
+    type_gauges = {"project": Projects, "component": Components,
+                   "release": Releases}
+    combined_data = defaultdict(dict)
+    for row in fetch_results(client, database, design_doc, view, group=True):
+        year, doc_type = row["key"]
+        if len(year) == 4 and year.isdigit():
+            combined_data[int(year)][doc_type] = row["value"]
+        else:
+            print(f"Invalid createdOn year '{year}' for {row['value']} "
+                  f"{doc_type} documents. Skipping these entries.")
+
+    # Drop children of a previous run once the new values are known, they
+    # may no longer exist
+    for doc_type, gauge in type_gauges.items():
+        gauge.clear()
+        set_gauge_values(gauge, [
+            ((year,), metrics.get(doc_type, 0))
+            for year, metrics in combined_data.items()])
 
 
 # -------------Cleared/Not Cleared Release status based on Type----------------
 def query_execution_releases_ecc_cleared_status(client: CloudantV1,
                                                 database: str):
     print('\nExecuting the query for release clearing status................/')
-    design_doc = "Release"
-    view = "byECCStatus"
-    map_function = {'map': """
-        function(doc) {
-            if (doc.type === 'release' && doc.eccInformation) {
-                var eccStatus = doc.eccInformation.eccStatus || 'UNKNOWN';
-                var componentType = doc.componentType || 'UNKNOWN';
-                emit(doc.componentId, [eccStatus, componentType]);
-            }
-        }
-        """}
-
-    # Creating temporary view byECCStatus for release
-    save_new_view(client, database, design_doc, view, map_function)
-
-    # Fetch results from the new view
-    result = list(fetch_results(client, database, design_doc, "byECCStatus"))
-
-    if not result:
-        print("No results found for the view byECCStatus.")
+    design_doc, view, _ = count_by_type_and_ecc_status_view
+
+    # Number of releases per type and status combination, counted by CouchDB
+    type_status_count = [
+        (tuple(row["key"]), row["value"])
+        for row in fetch_results(client, database, design_doc, view,
+                                 group=True)]
+
+    # Drop children of a previous run, they may no longer exist
+    release_clearing_status.clear()
+    if not type_status_count:
+        print("No results found for the view "
+              "countByComponentTypeAndECCStatus.")
         return
 
-    # Create a lookup dictionary for component types and statuses
-    type_status_count = defaultdict(int)
-    for row in result:
-        ecc_status, comp_type = row["value"]
-        # print(f"ecc_status, comp_type {(ecc_status, comp_type)}")
-        comp_type = comp_type or "EMPTY"
-        ecc_status = ecc_status or "EMPTY"
-        type_status_count[(comp_type, ecc_status)] += 1
-
     # Update Prometheus metrics
-    for (comp_type, status), count in type_status_count.items():
-        release_clearing_status.labels(
-            type=comp_type, status=status).set(count)
+    set_gauge_values(release_clearing_status, type_status_count)
 
 
 def query_execution_most_used_comp(client: CloudantV1, database: str):
     print('\nExecuting the query for most used components.................../')
-    design_doc = "Release"
-    view = "byReleaseIdAndComponent"
-    map_function = {
-        'map': "function(doc) {  if (doc.type == 'release') {"
-               "  emit(doc.componentId, doc.name) }}"}
-
-    # Creating temporary view byReleaseIdAndComponent for release
-    save_new_view(client, database, design_doc, view, map_function)
+    design_doc, view, _ = count_by_component_view
 
-    # Fetch results from the new view
-    result = list(fetch_results(client, database, design_doc,
-                                "byReleaseIdAndComponent"))
+    # Number of releases per component and release name, counted by CouchDB
+    result = fetch_results(client, database, design_doc, view, group=True)
 
-    if not result:
-        print("No results found for the view byReleaseIdAndComponent.")
-        return
-
-    key_counts = {}
+    key_counts = Counter()
+    # First release name of each component
+    name_of = {}
     for row in result:
-        key = row["key"]
-        name = row["value"]
-        if key in key_counts:
-            key_counts[key]["count"] += 1
-        else:
-            key_counts[key] = {"key": key, "Component name": name, "count": 1}
-
-    result_list = list(key_counts.values())
-    sorted_list = sorted(result_list, key=lambda x: x["count"], reverse=True)
+        key, name = row["key"]
+        key_counts[key] += row["value"]
+        name_of.setdefault(key, name)
+
+    # Drop children of a previous run, they may no longer exist
+    most_used_component_count.clear()
+    if not key_counts:
+        print("No results found for the view countByComponentIdAndName.")
+        return
 
     # Update Prometheus metrics
-    for item in sorted_list:
-        most_used_component_count.labels(
-            componentId=item["key"],
-            Component=item["Component name"]).set(item["count"])
+    set_gauge_values(most_used_component_count, [
+        ((key, name_of[key]), count)
+        for key, count in key_counts.most_common()])
 
 
 def query_execution_most_used_cleared_comp(client: CloudantV1, database: str):
     print('\nExecuting the query for most cleared components................/')
-    design_doc = "Release"
-    view = "byECCStatusAndName"
-    map_function = {'map': """
-        function(doc) {
-            if (doc.type === 'release' && doc.eccInformation) {
-                var eccStatus = doc.eccInformation.eccStatus || 'UNKNOWN';
-                var componentName = doc.name || 'UNKNOWN';
-                emit(doc.componentId, [eccStatus, componentName]);
-            }
-        }
-        """}
+    design_doc, view, _ = count_by_ecc_status_and_component_view
 
-    # Creating temporary view byECCStatus for release
-    save_new_view(client, database, design_doc, view, map_function)
-    # Fetch results from the new view
-    result = list(fetch_results(client, database, design_doc,
-                                "byECCStatusAndName"))
+    # Number of approved releases per component and release name, counted
+    # by CouchDB
+    result = fetch_results(client, database, design_doc, view, group=True,
+                           start_key=["APPROVED"], end_key=["APPROVED", {}])
 
-    if not result:
-        print("No results found for the view byReleaseIdAndComponent.")
-        return
-
-    key_counts = {}
+    key_counts = Counter()
+    # First approved release name of each component
+    name_of = {}
     for row in result:
-        key = row["key"]
-        ecc_status, component_name = row["value"]
-        if ecc_status == "APPROVED":
-            if key in key_counts:
-                key_counts[key]["count"] += 1
-            else:
-                key_counts[key] = {
-                    "key": key, "Component name": component_name, "count": 1}
-
-    result_list = list(key_counts.values())
-    sorted_list = sorted(result_list, key=lambda x: x["count"], reverse=True)
+        _, key, component_name = row["key"]
+        key_counts[key] += row["value"]
+        name_of.setdefault(key, component_name)
+
+    # Drop children of a previous run, they may no longer exist
+    most_cleared_component_count.clear()
+    if not key_counts:
+        print("No approved releases found for the view "
+              "countByECCStatusComponentIdAndName.")
+        return
 
     # Update Prometheus metrics
-    for item in sorted_list:
-        most_cleared_component_count.labels(
-            componentId=item["key"], Component=item["Component name"]).set(
-            item["count"])
+    set_gauge_values(most_cleared_component_count, [
+        ((key, name_of[key]), count)
+        for key, count in key_counts.most_common()])
 
 
 def query_execution_most_used_licenses(client: CloudantV1, database: str):
     print('\nExecuting the query for most used licenses.................../')
-    design_doc = "Component"
-    view = "bymainLicenseIdArr"
-    map_function = {
-        'map': "function(doc) { if (doc.type == 'component') {"
-               " if(doc.mainLicenseIds) { for(var i in doc.mainLicenseIds){"
-               "  emit(doc.mainLicenseIds[i], doc._id); }}"
-               " else { emit('EMPTY', doc._id); } } }"}
+    design_doc, view, _ = count_by_license_view
 
-    # Creating temporary view bymainLicenseIdArr for Component
-    save_new_view(client, database, design_doc, view, map_function)
+    # Number of components per license, counted by CouchDB
+    result = fetch_results(client, database, design_doc, view, group=True)
 
-    result = fetch_results(client, database, design_doc, "bymainLicenseIdArr")
+    sorted_license_list = sorted(
+        ((row["key"], row["value"]) for row in result), key=itemgetter(1),
+        reverse=True)
 
-    license_count = Counter(item['key'] for item in result)
-
-    sorted_license_list = sorted(license_count.items(), key=lambda x: x[1],
-                                 reverse=True)
-
-    # Update Prometheus metrics
-    for lic, count in sorted_license_list:
-        most_used_license_count.labels(License=lic).set(count)
+    # Update Prometheus metrics, dropping children of a previous run
+    most_used_license_count.clear()
+    set_gauge_values(most_used_license_count, [
+        ((lic,), count) for lic, count in sorted_license_list])
 
 
 def query_execution_comp_not_used(client: CloudantV1, database: str):
     print('\nExecuting the query for components not being used............../')
-
-    # Create views to fetch necessary data
-    project_design_doc = "Project"
-    release_design_doc = "Release"
-    project_view = "byReleaseId"
-    release_view = "byReleaseIdAndComponentId"
-
-    project_map_function = {
-        'map': "function(doc) {  if (doc.type == 'project') {"
-               "  emit(doc.releaseId, null) }}"}
-
-    release_map_function = {
-        'map': "function(doc) {  if (doc.type == 'release') {"
-               "  emit(doc._id, doc.componentId) }}"}
-
-    # Creating temporary views
-    save_new_view(client, database, project_design_doc, project_view,
-                  project_map_function)
-    save_new_view(client, database, release_design_doc, release_view,
-                  release_map_function)
-
-    # Fetch results from the views
-    proj_rel_results = fetch_results(client, database, project_design_doc,
-                                     project_view)
-    all_release_results = fetch_results(client, database, release_design_doc,
-                                        release_view)
-
-    if proj_rel_results is None or all_release_results is None:
-        print("No results found for the views.")
+    unused_components = [
+        ((component_id, name or "N/A"), 1)
+        for component_id, name in fetch_unused_releases(client, database)]
+
+    # Drop children of a previous run, they may no longer exist
+    unused_component_count.clear()
+    if not unused_components:
+        print("No unused releases found for the view "
+              f"{release_usage_view}.")
         return
 
-    # Extract release IDs used in projects and all release IDs
-    proj_rel_id_list = {row["key"] for row in proj_rel_results}
-    rel_id_list = {row["key"] for row in all_release_results}
+    # Update Prometheus metrics
+    set_gauge_values(unused_component_count, unused_components)
+
 
-    # Find unused release IDs
-    unused_release_ids = rel_id_list - proj_rel_id_list
+def run_once(client: CloudantV1, sw360_db: str, attachment_db: str) -> list:
+    """
+    Update all metrics of the registry from the databases. A failing query
+    is reported and only leaves its own gauges unchanged.
+    :param client: Cloudant client
+    :param sw360_db: Name of the SW360 database
+    :param attachment_db: Name of the attachment database
+    :return: Gauges of the queries which failed
+    """
+    # Create missing views up front, the queries only read them
+    ensure_views(client, sw360_db, sw360_views)
+    ensure_views(client, attachment_db, attachment_views)
+
+    # (query, arguments, gauges updated by the query), the queries are
+    # independent and update different gauges
+    queries = [
+        (query_execution_count_all, (client, sw360_db),
+         [projects_count, releases_count, components_count_total]),
+        (query_execution_attachment_usage_all, (client, attachment_db),
+         [attachment_count]),
+        (query_execution_component_by_type,
+         (client, sw360_db, component_type_view[2]["map"],
+          component_type_view[1], "...", "components_count_total_",
+          component_type_gauges, registry),
+         component_type_gauges.values()),
+        (query_comp_proj_rel_time_series_execution, (client, sw360_db),
+         [Projects, Components, Releases]),
+        (query_execution_releases_ecc_cleared_status, (client, sw360_db),
+         [release_clearing_status]),
+        (query_execution_most_used_comp, (client, sw360_db),
+         [most_used_component_count]),
+        (query_execution_most_used_cleared_comp, (client, sw360_db),
+         [most_cleared_component_count]),
+        (query_execution_most_used_licenses, (client, sw360_db),
+         [most_used_license_count]),
+        (query_execution_comp_not_used, (client, sw360_db),
+         [unused_component_count]),
+    ]
 
-    # Filter releases that are not used
-    unused_components = [{
-        "key": row["value"], "name": row.get("doc", {}).get("name", "N/A")}
-        for row in all_release_results if row["key"] in unused_release_ids]
+    # Periodically fetch data and update Prometheus metrics
+    failed_gauges = []
+    with ThreadPoolExecutor(max_workers=MAX_QUERY_WORKERS) as executor:
+        futures = {executor.submit(query, *args): (query.__name__, gauges)
+                   for query, args, gauges in queries}
+        for future in as_completed(futures):
+            wait_for_query(future, *futures[future], failed_gauges)
+    return failed_gauges
 
-    # Update Prometheus metrics
-    for item in unused_components:
-        unused_component_count.labels(
-            component=item["key"], name=item["name"]).set(1)
+
+def serve_metrics(client: CloudantV1, sw360_db: str, attachment_db: str):
+    """
+    Expose the metrics on `/metrics` for Prometheus to scrape and refresh
+    them every `METRICS_REFRESH_SECONDS` seconds, until interrupted.
+    """
+    port = get_metrics_port()
+    refresh_seconds = get_metrics_refresh_seconds()
+    start_http_server(port, registry=registry)
+    print(f"Serving metrics on port {port}, refreshing every "
+          f"{refresh_seconds}s")
+    while True:
+        start_time = time.time()
+        try:
+            run_once(client, sw360_db, attachment_db)
+            print('Metrics refreshed in {0:.2f}s'
+                  .format(time.time() - start_time))
+        except Exception as e:
+            print('Exception message ', e)
+        time.sleep(max(0.0, refresh_seconds - (time.time() - start_time)))
 
 
-def main():
+def main(serve: bool = False):
     print("\n Execution starting for exporter ............")
     client = get_cloudant_client()
     sw360_db = get_sw360_db_name()
     attachment_db = get_attachment_db_name()
 
-    # Periodically fetch data and update Prometheus metrics
-    query_execution_count_all(client, sw360_db)
-    query_execution_attachment_usage_all(client, attachment_db)
-    query_execution_component_by_type(
-        client, sw360_db, "function(doc) {"
-                          " if (doc.type == 'component') {"
-                          "  emit(doc.componentType, doc._id);"
-                          " }"
-                          "}", "bycomponenttype", "...",
-        "components_count_total_", component_type_gauges, registry)
-    query_comp_proj_rel_time_series_execution(client, sw360_db)
-    query_execution_releases_ecc_cleared_status(client, sw360_db)
-    query_execution_most_used_comp(client, sw360_db)
-    query_execution_most_used_cleared_comp(client, sw360_db)
-    query_execution_most_used_licenses(client, sw360_db)
-    query_execution_comp_not_used(client, sw360_db)
+    if serve:
+        serve_metrics(client, sw360_db, attachment_db)
+        return
+
+    failed_gauges = run_once(client, sw360_db, attachment_db)
     print("Code executed")
-    delete_from_gateway(get_pushgateway_url(), job='couchdb_exporter',
-                        grouping_key={'instance': 'latest'})
-    push_metrics('couchdb_exporter', registry)
+    push_registry(registry, 'couchdb_exporter', failed_gauges)
     print("\n Execution ended for exporter ............")
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--serve', action='store_true',
+        help='keep running and expose the metrics over HTTP instead of '
+             'pushing them once to the push gateway')
+    args = parser.parse_args()
     try:
         start_time = time.time()
-        main()
+        main(args.serve)
         print('\nExecution time: ' + "{0:.2f}"
               .format(time.time() - start_time) + 's')
 
+    except KeyboardInterrupt:
+        print("\nExecution interrupted by user")
     except Exception as e:
         print('Exception message ', e)
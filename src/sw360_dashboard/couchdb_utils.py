@@ -7,27 +7,69 @@
 # This utility provides helper functions for connection with cloudant,
 # pushgateway, etc.
 
+import hashlib
+import json
 import os
+import threading
 import time
 from collections import defaultdict, Counter
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
+from itertools import chain
 
 import backoff
 import dotenv
+import requests
 import requests.exceptions
-from ibm_cloud_sdk_core import ApiException
+from ibm_cloud_sdk_core import ApiException, DetailedResponse
 from ibm_cloud_sdk_core.authenticators import BasicAuthenticator
-from ibmcloudant.cloudant_v1 import CloudantV1, DesignDocument, \
-    DesignDocumentViewsMapReduce
-from prometheus_client import push_to_gateway, CollectorRegistry, Gauge
+from ibm_cloud_sdk_core.http_adapter import SSLHTTPAdapter
+from ibmcloudant.cloudant_v1 import BulkDocs, CloudantV1, DesignDocument, \
+    DesignDocumentViewsMapReduce, Document
+from prometheus_client import push_to_gateway, pushadd_to_gateway, \
+    delete_from_gateway, CollectorRegistry, Gauge
+from requests.adapters import HTTPAdapter
+
+try:
+    # Optional, decodes the large view responses faster than json
+    import orjson
+except ImportError:
+    orjson = None
 
 MAX_BACKOFF_RETRIES = 100
 MAX_BACKOFF_TIME = 300
 MAX_PUSH_GATEWAY_RETRIES = 5
 
 CLOUDANT_LIMIT_MAX = 4294967295
+CLOUDANT_POOL_SIZE = 32
+VIEW_PAGE_SIZE = 5000
+ALL_DOCS_KEYS_BATCH_SIZE = 2000
 
+# Documents by type, reduced to the number of documents per type
+count_by_type_view = ("Common", "countByType", {
+    'map': "function(doc) {  if (doc.type) {  emit(doc.type, null) }}",
+    'reduce': "_count"})
 
+# Views already checked/created by save_new_view in this process
+_views_ensured = set()
+# Map/reduce functions of the views ensured, to create them again if missing
+_view_functions = {}
+# Views missing in the database, which are not created with DRY_RUN=true
+_views_not_created = set()
+_design_doc_locks = defaultdict(threading.Lock)
+
+# Views known to exist, kept across runs: view -> signature of its functions
+VIEW_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache',
+                               'sw360_dashboard', 'views.json')
+_view_cache_lock = threading.Lock()
+
+
+class ViewNotCreatedError(Exception):
+    """A view is read which does not exist and is not created in dry run"""
+
+
+@lru_cache(maxsize=1)
 def get_cloudant_client() -> CloudantV1:
     dotenv.load_dotenv()
     couchdb_password = os.getenv('COUCHDB_PASSWORD', None)
@@ -43,19 +85,85 @@ def get_cloudant_client() -> CloudantV1:
     client = CloudantV1(authenticator=authenticator)
     client.set_service_url(os.getenv('COUCHDB_HOST'))
     client.configure_service(os.getenv('COUCHDB_HOST'))
+    # One kept-alive connection pool shared by all requests of the client
+    http_adapter = SSLHTTPAdapter(
+        pool_maxsize=CLOUDANT_POOL_SIZE, pool_block=True,
+        _disable_ssl_verification=client.disable_ssl_verification)
+    http_client = client.get_http_client()
+    http_client.mount('http://', http_adapter)
+    http_client.mount('https://', http_adapter)
+    client.http_adapter = http_adapter
     return client
 
 
+@lru_cache(maxsize=1)
 def get_pushgateway_url() -> str:
     dotenv.load_dotenv()
     return os.getenv('PUSHGATEWAY_URL', 'localhost:9091')
 
 
+@lru_cache(maxsize=1)
+def get_pushgateway_session() -> requests.Session:
+    # Keep the connection to the push gateway alive across requests, the
+    # pushes are retried by backoff
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def pushgateway_handler(url, method, timeout, headers, data):
+    """
+    Handler for the push gateway functions of prometheus_client sending the
+    requests with the shared session of `get_pushgateway_session()`.
+    """
+    def handle():
+        response = get_pushgateway_session().request(
+            method, url, data=data, headers=dict(headers), timeout=timeout)
+        if response.status_code >= 400:
+            raise OSError(f"error talking to pushgateway: "
+                          f"{response.status_code} {response.reason}")
+    return handle
+
+
+@lru_cache(maxsize=1)
+def get_view_update() -> str:
+    """
+    Update mode for view reads: `lazy` serves the last built index and
+    updates it afterwards, `true` waits for the index to be up-to-date.
+    """
+    dotenv.load_dotenv()
+    return os.getenv('COUCHDB_VIEW_UPDATE', 'lazy')
+
+
+@lru_cache(maxsize=1)
+def get_metrics_port() -> int:
+    dotenv.load_dotenv()
+    return int(os.getenv('METRICS_PORT', 8000))
+
+
+@lru_cache(maxsize=1)
+def get_metrics_refresh_seconds() -> int:
+    dotenv.load_dotenv()
+    return int(os.getenv('METRICS_REFRESH_SECONDS', 300))
+
+
+@lru_cache(maxsize=1)
 def get_database_name() -> str:
     dotenv.load_dotenv()
     return os.getenv('COUCHDB_DATABASE', 'sw360db')
 
 
+@lru_cache(maxsize=1)
+def is_dry_run() -> bool:
+    """
+    Views are not created in the database unless `DRY_RUN=false`.
+    """
+    dotenv.load_dotenv()
+    return os.getenv('DRY_RUN', 'true').lower() == 'true'
+
+
 def get_sw360_db_name() -> str:
     return 'sw360db'
 
@@ -100,31 +208,150 @@ def giveup_not_indexing_exception(ex: Exception) -> bool:
     return True
 
 
+def get_json_result(response: DetailedResponse):
+    """
+    Decode the body of a response requested with `stream=True`, with orjson
+    if it is installed.
+    :param response: Response of the Cloudant client
+    :return: Decoded JSON body, None if there is no body
+    """
+    result = response.get_result()
+    if result is None:
+        return None
+    return orjson.loads(result.content) if orjson else result.json()
+
+
 @backoff.on_exception(backoff.expo, ApiException,
                       max_tries=MAX_BACKOFF_RETRIES,
                       max_time=MAX_BACKOFF_TIME,
                       giveup=giveup_not_timeout_exception,
                       on_backoff=backoff_printer,
-                      on_giveup=giveup_printer,
-                      raise_on_giveup=False)
-def fetch_results(client: CloudantV1, database: str, design_doc: str,
-                  view_name: str) -> list | None:
+                      on_giveup=giveup_printer)
+def fetch_view_page(client: CloudantV1, database: str, design_doc: str,
+                    view_name: str, update: str, limit: int,
+                    start_key=None, start_key_doc_id: str | None = None,
+                    **view_params) -> list:
     """
-    Get data from a view of a design document.
+    Get one page of rows from a view of a design document.
     :param client: Cloudant client
     :param database: Name of the database
     :param design_doc: Name of the design document
     :param view_name: Name of the view
-    :return: List of results from the view
+    :param update: View update mode
+    :param limit: Maximum number of rows
+    :param start_key: Key of the first row, None to start at the beginning
+    :param start_key_doc_id: Document id of the first row
+    :param view_params: Further view parameters, like `group` or `end_key`
+    :return: List of rows of the page
+    :raises ApiException: If the page cannot be read, after retrying timeouts
     """
     result = []
-    response = client.post_view(database, design_doc, view_name,
-                                timeout=1000).get_result()
+    response = get_json_result(client.post_view(
+        database, design_doc, view_name, update=update, stable=True,
+        limit=limit, start_key=start_key, start_key_doc_id=start_key_doc_id,
+        timeout=1000, stream=True, **view_params))
     if response is not None:
         result = response.get('rows', [])
     return result
 
 
+def fetch_results(client: CloudantV1, database: str, design_doc: str,
+                  view_name: str, update: str | None = None,
+                  page_size: int = VIEW_PAGE_SIZE, start_key=None,
+                  **view_params):
+    """
+    Get data from a view of a design document. The rows are fetched page by
+    page, continuing after the key (and document id) of the last row.
+    :param client: Cloudant client
+    :param database: Name of the database
+    :param design_doc: Name of the design document
+    :param view_name: Name of the view
+    :param update: View update mode, defaults to `get_view_update()`
+    :param page_size: Number of rows fetched per request
+    :param start_key: Key of the first row, None to start at the beginning
+    :param view_params: Further view parameters, like `group` or `end_key`
+    :return: Generator over the rows of the view
+    :raises ApiException: If a page cannot be read, no partial result is
+        returned as complete
+    """
+    update = update or get_view_update()
+    # Whether all rows read so far have a null key
+    null_keys_only = start_key is None
+    start_key_doc_id = None
+    skip = None
+    recreated = False
+    while True:
+        if (database, design_doc, view_name) in _views_not_created:
+            raise ViewNotCreatedError(
+                f"View '{view_name}' of design document '{design_doc}' does "
+                "not exist, it is not created with DRY_RUN=true")
+        # Fetch one extra row, it is the first row of the next page
+        try:
+            rows = fetch_view_page(client, database, design_doc, view_name,
+                                   update, page_size + 1, start_key,
+                                   start_key_doc_id, skip=skip,
+                                   **view_params)
+        except ApiException as ex:
+            map_function = _view_functions.get(
+                (database, design_doc, view_name))
+            if ex.status_code != 404 or recreated or map_function is None:
+                raise
+            # The view was removed after it was ensured (e.g. the design
+            # document was replaced), create it again and retry once
+            print(f"View '{view_name}' of design document '{design_doc}' "
+                  "is missing, creating it again.")
+            forget_view(client, database, design_doc, view_name)
+            save_new_view(client, database, design_doc, view_name,
+                          map_function)
+            recreated = True
+            continue
+        yield from rows[:page_size]
+        if len(rows) <= page_size:
+            return
+        # Rows of grouped reduce views have unique keys and no id
+        start_key = rows[page_size]['key']
+        start_key_doc_id = rows[page_size].get('id')
+        if start_key is None:
+            # A null start key is dropped from the request by the client.
+            # Null keys sort first, so the rows read so far are skipped
+            # instead to continue in the rows with a null key
+            if not null_keys_only:
+                raise ValueError(f"Cannot continue reading view '{view_name}'"
+                                 " after a null key")
+            start_key_doc_id = None
+            skip = (skip or 0) + page_size
+        else:
+            null_keys_only = False
+            skip = None
+
+
+def fetch_docs_by_ids(client: CloudantV1, database: str, ids, doc_type: str,
+                      batch_size: int = ALL_DOCS_KEYS_BATCH_SIZE) -> list:
+    """
+    Get the documents of the given type by their ids with `_all_docs`. The ids
+    are requested in batches, in parallel on the connection pool.
+    :param client: Cloudant client
+    :param database: Name of the database
+    :param ids: Document ids, duplicates are fetched once
+    :param doc_type: Type of the documents to keep
+    :param batch_size: Number of ids per request
+    :return: List of the documents found
+    """
+    ids = list(dict.fromkeys(ids))
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+    def fetch_batch(keys):
+        return get_json_result(client.post_all_docs(
+            db=database, keys=keys, include_docs=True, stream=True))["rows"]
+
+    with ThreadPoolExecutor(max_workers=CLOUDANT_POOL_SIZE) as executor:
+        # Missing ids have no doc, deleted documents a null one
+        return [row["doc"]
+                for rows in executor.map(fetch_batch, batches)
+                for row in rows
+                if row.get("doc") and row["doc"].get("type") == doc_type]
+
+
 @backoff.on_exception(backoff.expo, ApiException,
                       max_tries=MAX_BACKOFF_RETRIES,
                       max_time=MAX_BACKOFF_TIME, on_backoff=backoff_printer,
@@ -162,35 +389,235 @@ def create_new_view_in_db(client: CloudantV1, db_name: str, design_doc: str,
     return True
 
 
+@lru_cache(maxsize=1)
+def _load_view_cache() -> dict[str, str]:
+    try:
+        with open(VIEW_CACHE_FILE, encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _view_cache_key(client: CloudantV1, db_name: str, design_doc: str,
+                    view: str) -> str:
+    return f"{client.service_url}/{db_name}/_design/{design_doc}/{view}"
+
+
+def _view_signature(map_function: dict[str, str]) -> str:
+    return hashlib.blake2b(json.dumps(map_function, sort_keys=True).encode(),
+                           digest_size=16).hexdigest()
+
+
+def is_view_ensured(client: CloudantV1, db_name: str, design_doc: str,
+                    view: str, map_function: dict[str, str]) -> bool:
+    """
+    Check if the view was already checked/created, in this process or in an
+    earlier run with the same map/reduce functions.
+    """
+    if (db_name, design_doc, view) in _views_ensured:
+        return True
+    key = _view_cache_key(client, db_name, design_doc, view)
+    if _load_view_cache().get(key) == _view_signature(map_function):
+        _views_ensured.add((db_name, design_doc, view))
+        return True
+    return False
+
+
+def _save_view_cache(cache: dict[str, str]):
+    try:
+        os.makedirs(os.path.dirname(VIEW_CACHE_FILE), exist_ok=True)
+        with open(VIEW_CACHE_FILE, 'w', encoding='utf-8') as cache_file:
+            json.dump(cache, cache_file, indent=2, sort_keys=True)
+    except OSError as ex:
+        print(f"Could not save the view cache: {ex}")
+
+
+def remember_views(client: CloudantV1, db_name: str,
+                   views: list[tuple[str, str, dict[str, str]]]):
+    """
+    Save existing views in the view cache file, later runs skip checking them.
+    """
+    with _view_cache_lock:
+        cache = _load_view_cache()
+        cache.update(
+            (_view_cache_key(client, db_name, design_doc, view),
+             _view_signature(map_function))
+            for design_doc, view, map_function in views)
+        _save_view_cache(cache)
+
+
+def forget_view(client: CloudantV1, db_name: str, design_doc: str,
+                view: str):
+    """
+    Drop a view found missing from the ensured views and the view cache file,
+    so it is checked/created again.
+    """
+    _views_ensured.discard((db_name, design_doc, view))
+    with _view_cache_lock:
+        cache = _load_view_cache()
+        if cache.pop(_view_cache_key(client, db_name, design_doc, view),
+                     None) is not None:
+            _save_view_cache(cache)
+
+
 def save_new_view(client: CloudantV1, db_name: str, design_doc: str, view: str,
                   map_function: dict[str, str]):
-    design_exists = False
-    view_created = False
+    _view_functions[(db_name, design_doc, view)] = map_function
+    if is_view_ensured(client, db_name, design_doc, view, map_function):
+        return
+    # Queries running in parallel must not update the same design document
+    with _design_doc_locks[(db_name, design_doc)]:
+        if (db_name, design_doc, view) in _views_ensured:
+            return
+        design_exists = False
+        view_created = False
+        try:
+            response = client.get_design_document(db_name, design_doc,
+                                                  latest=True).get_result()
+            if view in response.get('views', {}):
+                print(f"View '{view}' already exists in design "
+                      f"document '{design_doc}'.")
+                design_exists = True
+        except Exception:
+            pass
+        if not design_exists:
+            print(f"Creating view '{view}' in design document "
+                  f"'{design_doc}'.")
+            if not is_dry_run():
+                view_created = True if create_new_view_in_db(
+                    client, db_name, design_doc, view,
+                    map_function) is not None else False
+                design_exists = view_created
+            else:
+                print("Dry run, the view is not created.")
+                _views_not_created.add((db_name, design_doc, view))
+
+        if view_created:
+            print("Time delay for new view to be processed before accessing "
+                  "it")
+            time.sleep(5)
+            wait_for_view_indexing(client, db_name, design_doc, view)
+        if design_exists:
+            remember_views(client, db_name,
+                           [(design_doc, view, map_function)])
+        _views_ensured.add((db_name, design_doc, view))
+
+
+def ensure_views(client: CloudantV1, db_name: str,
+                 views: list[tuple[str, str, dict[str, str]]]):
+    """
+    Create the missing views of a database at once: the design documents are
+    read with one _all_docs request and all changed design documents are
+    written with one _bulk_docs request. The views are marked as ensured, so
+    later save_new_view calls for them return immediately, and saved in the
+    view cache file, so later runs do not read the design documents again.
+    :param client: Cloudant client
+    :param db_name: Name of the database
+    :param views: List of (design document, view, map/reduce functions)
+    """
+    _view_functions.update(((db_name, design_doc, view), map_function)
+                           for design_doc, view, map_function in views)
+    views = [(design_doc, view, map_function)
+             for design_doc, view, map_function in views
+             if not is_view_ensured(client, db_name, design_doc, view,
+                                    map_function)]
+    if not views:
+        return
     try:
-        response = client.get_design_document(db_name, design_doc,
-                                              latest=True).get_result()
-        if view in response.get('views', {}):
-            print(f"View '{view}' already exists in design "
-                  f"document '{design_doc}'.")
-            design_exists = True
-    except Exception:
-        pass
-    if not design_exists:
-        print(f"Creating view '{view}' in design document '{design_doc}'.")
-        dotenv.load_dotenv()
-        dry_run = os.getenv('DRY_RUN', True)
-        dry_run = dry_run is True or dry_run.lower() == "true"
-        if not dry_run:
-            view_created = True if create_new_view_in_db(
-                client, db_name, design_doc, view,
-                map_function) is not None else False
+        design_ids = list({f"_design/{design_doc}"
+                           for design_doc, _, _ in views})
+        rows = client.post_all_docs(db=db_name, keys=design_ids,
+                                    include_docs=True).get_result()["rows"]
+        design_docs = {row["key"]: row["doc"] for row in rows
+                       if row.get("doc")}
+
+        created = []
+        for design_doc, view, map_function in views:
+            doc = design_docs.setdefault(f"_design/{design_doc}", {
+                "_id": f"_design/{design_doc}", "views": {}})
+            if view in doc.setdefault("views", {}):
+                continue
+            print(f"Creating view '{view}' in design document "
+                  f"'{design_doc}'.")
+            doc["views"][view] = {key: value
+                                  for key, value in map_function.items()
+                                  if value is not None}
+            created.append((design_doc, view))
+
+        dry_run = is_dry_run()
+        if created and not dry_run:
+            changed_ids = {f"_design/{design_doc}"
+                           for design_doc, _ in created}
+            results = client.post_bulk_docs(
+                db=db_name, bulk_docs=BulkDocs(docs=[
+                    Document.from_dict(doc)
+                    for doc_id, doc in design_docs.items()
+                    if doc_id in changed_ids])).get_result()
+            failed = [result for result in results if not result.get("ok")]
+            if failed:
+                raise ApiException(500, message=f"Failed to save {failed}")
+            print("Time delay for new views to be processed before accessing "
+                  "them")
+            time.sleep(5)
+            for design_doc, view in created:
+                wait_for_view_indexing(client, db_name, design_doc, view)
+        if dry_run:
+            print("Dry run, the views are not created.")
+            _views_not_created.update((db_name, design_doc, view)
+                                      for design_doc, view in created)
         else:
-            view_created = True
+            remember_views(client, db_name, views)
+    except ApiException as ex:
+        # Fall back to creating the views one by one
+        print(f"Error ensuring views in '{db_name}': {ex}")
+        for design_doc, view, map_function in views:
+            save_new_view(client, db_name, design_doc, view, map_function)
+        return
+    _views_ensured.update((db_name, design_doc, view)
+                          for design_doc, view, _ in views)
 
-    if view_created:
-        print("Time delay for new view to be processed before accessing it")
-        time.sleep(5)
-        wait_for_view_indexing(client, db_name, design_doc, view)
+
+def remove_views(client: CloudantV1, db_name: str,
+                 views: list[tuple[str, str]]):
+    """
+    Remove views from their design documents: the design documents are read
+    with one _all_docs request and the changed ones are written with one
+    _bulk_docs request. CouchDB rebuilds the remaining views of a changed
+    design document once.
+    :param client: Cloudant client
+    :param db_name: Name of the database
+    :param views: List of (design document, view)
+    """
+    design_ids = list({f"_design/{design_doc}" for design_doc, _ in views})
+    rows = client.post_all_docs(db=db_name, keys=design_ids,
+                                include_docs=True).get_result()["rows"]
+    design_docs = {row["key"]: row["doc"] for row in rows if row.get("doc")}
+
+    removed = []
+    for design_doc, view in views:
+        doc = design_docs.get(f"_design/{design_doc}")
+        if doc is None or view not in doc.get("views", {}):
+            continue
+        print(f"Removing view '{view}' from design document '{design_doc}'.")
+        del doc["views"][view]
+        removed.append((design_doc, view))
+
+    if not removed:
+        print(f"No views to remove in '{db_name}'.")
+        return
+    if is_dry_run():
+        print("Dry run, the views are not removed.")
+        return
+    changed_ids = {f"_design/{design_doc}" for design_doc, _ in removed}
+    results = client.post_bulk_docs(
+        db=db_name, bulk_docs=BulkDocs(docs=[
+            Document.from_dict(doc) for doc_id, doc in design_docs.items()
+            if doc_id in changed_ids])).get_result()
+    failed = [result for result in results if not result.get("ok")]
+    if failed:
+        raise ApiException(500, message=f"Failed to save {failed}")
+    for design_doc, view in removed:
+        forget_view(client, db_name, design_doc, view)
 
 
 @backoff.on_exception(backoff.expo, ApiException,
@@ -205,37 +632,43 @@ def wait_for_view_indexing(client, db_name, design_doc, view):
                      limit=1).get_result()
 
 
+@lru_cache(maxsize=None)
+def _year_of_date(date_string: str) -> int | None:
+    # Many rows share the same date, each distinct date is parsed once
+    try:
+        # Fast path for zero-padded dates, still checking the date is valid
+        year, month, day = (date_string[:4], date_string[5:7],
+                            date_string[8:])
+        if len(date_string) == 10 and date_string[4] == date_string[7] == '-' \
+                and (year + month + day).isdigit():
+            return date(int(year), int(month), int(day)).year
+        # Ensure date_string follows the expected format
+        return datetime.strptime(date_string, "%Y-%m-%d").year
+    except ValueError:
+        return None
+
+
 def format_for_time_series(result, doc, key_str="key", value_str="value",
                            year_filter=False):
-    upd_result = []
-    for item in list(result):
+    year_counts = Counter()
+    for item in result:
         date_string = item[key_str]
         if date_string:
-            try:
-                # Ensure date_string follows the expected format
-                date_object = datetime.strptime(date_string, "%Y-%m-%d")
-                year = date_object.year
-                if year_filter and year > 2015:
-                    upd_result.append({"key": year, "value": item[value_str]})
-                if not year_filter:
-                    upd_result.append({"key": year, "value": item[value_str]})
-            except ValueError:
+            year = _year_of_date(date_string)
+            if year is None:
                 # Handle invalid date formats
                 print(f"Invalid date format for entry: {date_string}. "
                       "Skipping this entry.")
                 continue
+            if not year_filter or year > 2015:
+                year_counts[year] += 1
         else:
             # Handle case where 'key' (createdOn date) is None or missing
             print(f"'key' (createdOn) is missing or None for entry: {item}. "
                   "Skipping this entry.")
             continue
-    grouped_data = defaultdict(list)
-
-    for entry in upd_result:
-        grouped_data[entry["key"]].append(entry["value"])
 
-    data = [{"Year": key, doc: len(values)} for key, values in
-            grouped_data.items()]
+    data = [{"Year": key, doc: count} for key, count in year_counts.items()]
 
     return data
 
@@ -243,9 +676,103 @@ def format_for_time_series(result, doc, key_str="key", value_str="value",
 @backoff.on_exception(backoff.expo, requests.exceptions.ChunkedEncodingError,
                       max_tries=MAX_PUSH_GATEWAY_RETRIES,
                       on_backoff=backoff_printer, on_giveup=giveup_printer)
-def push_metrics(job_name='couchdb_FT_exporter', registry=CollectorRegistry()):
+def push_metrics(registry: CollectorRegistry, job_name: str):
+    """
+    Push all metrics of the exporter's registry to the push gateway.
+    :param registry: Registry holding the gauges of the exporter
+    :param job_name: Name of the push gateway job
+    """
     push_to_gateway(get_pushgateway_url(), job=job_name, registry=registry,
-                    grouping_key={'instance': 'latest'})
+                    grouping_key={'instance': 'latest'},
+                    handler=pushgateway_handler)
+
+
+@backoff.on_exception(backoff.expo, requests.exceptions.ChunkedEncodingError,
+                      max_tries=MAX_PUSH_GATEWAY_RETRIES,
+                      on_backoff=backoff_printer, on_giveup=giveup_printer)
+def push_add_metrics(registry, job_name: str):
+    """
+    Add metrics to the push gateway job. Only metrics with the same names
+    are replaced, other metrics of the job are kept.
+    :param registry: Registry (or restricted registry) with the metrics
+    :param job_name: Name of the push gateway job
+    """
+    pushadd_to_gateway(get_pushgateway_url(), job=job_name,
+                       registry=registry,
+                       grouping_key={'instance': 'latest'},
+                       handler=pushgateway_handler)
+
+
+def push_metrics_per_family(registry: CollectorRegistry, job_name: str):
+    """
+    Push the metrics of the registry with one request per metric family, so
+    that a failed request only retries that family. Old metrics of the job
+    have to be deleted from the push gateway beforehand.
+    :param registry: Registry holding the gauges of the exporter
+    :param job_name: Name of the push gateway job
+    """
+    for metric in registry.collect():
+        sample_names = {sample.name for sample in metric.samples}
+        if sample_names:
+            push_add_metrics(registry.restricted_registry(sample_names),
+                             job_name)
+
+
+def push_registry(registry: CollectorRegistry, job_name: str,
+                  failed_gauges=()):
+    """
+    Replace the metrics of the push gateway job with the metrics of the
+    registry. The metrics of failed queries are left out instead, so they
+    keep their last pushed values (only the other metrics are replaced).
+    :param registry: Registry holding the gauges of the exporter
+    :param job_name: Name of the push gateway job
+    :param failed_gauges: Gauges of the queries which failed
+    """
+    if not failed_gauges:
+        delete_from_gateway(get_pushgateway_url(), job=job_name,
+                            grouping_key={'instance': 'latest'},
+                            handler=pushgateway_handler)
+        push_metrics(registry, job_name)
+        return
+    failed_names = {gauge.describe()[0].name for gauge in failed_gauges}
+    sample_names = {sample.name for metric in registry.collect()
+                    if metric.name not in failed_names
+                    for sample in metric.samples}
+    if sample_names:
+        push_add_metrics(registry.restricted_registry(sample_names),
+                         job_name)
+
+
+def wait_for_query(future: Future, name: str, gauges, failed_gauges: list):
+    """
+    Wait for a query running in an executor. An error is printed instead of
+    raised, so the metrics of the other queries are still published.
+    :param future: Future of the query
+    :param name: Name of the query, for the messages
+    :param gauges: Gauges updated by the query
+    :param failed_gauges: List the gauges are added to if the query fails
+    :return: Result of the query, None if it failed
+    """
+    try:
+        return future.result()
+    except ViewNotCreatedError as ex:
+        print(f"Skipping the query {name}: {ex}")
+    except Exception as ex:
+        print(f"Error in the query {name}: {ex}")
+    failed_gauges.extend(gauges)
+    return None
+
+
+def set_gauge_values(gauge: Gauge, items):
+    """
+    Set the children of a labelled gauge in one go.
+    :param gauge: Gauge with label names
+    :param items: Iterable of (label values, value), the label values in the
+        order of the gauge's label names
+    """
+    labels = gauge.labels
+    for label_values, value in items:
+        labels(*label_values).set(value)
 
 
 # Counting total number of comp, proj, rel
@@ -253,28 +780,33 @@ def query_execution_count_all(client: CloudantV1, database: str,
                               projects_count: Gauge, releases_count: Gauge,
                               components_count: Gauge, function_def: str,
                               view_name: str):
+    """
+    Count the projects, their releases and the components of these releases.
+    :param function_def: Map function emitting `['project', <project id>]`
+        once per project and `['release', <release id>]` per used release
+    :param view_name: Name of the view, it is reduced with `_count`
+    :return: The releases and components counted
+    """
     print('\nExecuting the query for counting total number of comp, proj,'
           ' rel.....')
 
-    # Counting total projects
-    design_doc = "Project"
-    map_function = {"map": function_def}
+    # Counting total projects, reduced to a single row by CouchDB
+    design_doc = "Common"
+    map_function = {"map": function_def, "reduce": "_count"}
     save_new_view(client, database, design_doc, view_name, map_function)
 
-    result = list(fetch_results(client, database, design_doc, view_name))
-    unique_proj = list(set([row['value'] for row in result]))
-
-    data_proj = {"key": "Projects", "value": len(unique_proj)}
+    row = next(fetch_results(client, database, design_doc, view_name,
+                             group_level=1, start_key=["project"],
+                             end_key=["project", {}]), None)
+    data_proj = {"key": "Projects", "value": row['value'] if row else 0}
 
-    # Counting total releases
-    id_list = [row["key"] for row in result]
+    # Counting total releases, grouping returns each release id once
+    id_list = [row["key"][1] for row in fetch_results(
+        client, database, design_doc, view_name, group=True,
+        start_key=["release"], end_key=["release", {}])]
 
     try:
-        db_query = client.post_find(
-            database, {
-                "type": "release", "_id": {"$in": id_list}},
-            limit=CLOUDANT_LIMIT_MAX).get_result()
-        result_rel = list(db_query["docs"])
+        result_rel = fetch_docs_by_ids(client, database, id_list, "release")
     except ApiException as ex:
         print(f"Error: {ex}")
         return None, None
@@ -283,11 +815,8 @@ def query_execution_count_all(client: CloudantV1, database: str,
     # Counting total components
     id_list = [doc["componentId"] for doc in result_rel]
     try:
-        db_query = client.post_find(
-            database, {
-                "type": "component", "_id": {"$in": id_list}},
-            limit=CLOUDANT_LIMIT_MAX).get_result()
-        result_comp = list(db_query["docs"])
+        result_comp = fetch_docs_by_ids(client, database, id_list,
+                                        "component")
     except ApiException as ex:
         print(f"Error: {ex}")
         return None, None
@@ -322,20 +851,24 @@ def query_execution_component_by_type(client: CloudantV1, database: str,
 
     result = fetch_results(client, database, design_doc, view_name)
 
-    grouped_data = defaultdict(list)
-    for entry in list(result):
-        grouped_data[
-            "empty" if not entry["key"] or entry["key"].strip() == ""
-            else entry["key"]
-        ].append(entry["value"])
+    # Only the number of components per type is needed
+    grouped_data = Counter(
+        "empty" if not entry["key"] or entry["key"].strip() == ""
+        else entry["key"]
+        for entry in result)
+
+    # Unregister the gauges of component types that no longer exist
+    for key in [key for key in component_type_gauges
+                if key not in grouped_data]:
+        registry.unregister(component_type_gauges.pop(key))
 
-    for key, values in grouped_data.items():
+    for key, count in grouped_data.items():
         gauge_name = f'{gauge_prefix}{key}'
         if key not in component_type_gauges:
             component_type_gauges[key] = Gauge(
                 gauge_name, f'Number of components of type {key}',
                 registry=registry)
-        component_type_gauges[key].set(len(values))
+        component_type_gauges[key].set(count)
 
 
 # -----------------Time Series by Year for Proj, Comp, Rel---------------------
@@ -354,7 +887,8 @@ def query_comp_proj_rel_time_series_execution(client: CloudantV1,
     # Temporary View
     save_new_view(client, database, design_doc, view_name, map_function)
 
-    result = list(fetch_results(client, database, design_doc, view_name))
+    # Stream the rows page by page, keeping the first row of each project
+    result = fetch_results(client, database, design_doc, view_name)
     unique_values = set()
     unique_results = []
     for row in result:
@@ -369,12 +903,12 @@ def query_comp_proj_rel_time_series_execution(client: CloudantV1,
     # ------------------------ReleaseCreatedOn---------------------------------
     print('\n  Executing the time-series query for release................../')
     data_rel = format_for_time_series(
-        list(result_rel), "Release", "createdOn", "_id", True)
+        result_rel, "Release", "createdOn", "_id", True)
 
     # ---------------------ComponentCreatedOn----------------------------------
     print('\n  Executing the time-series query for component................/')
     data_comp = format_for_time_series(
-        list(result_comp), "Component", "createdOn", "_id", True)
+        result_comp, "Component", "createdOn", "_id", True)
 
     combined_data = {}
     for item in data_proj + data_comp + data_rel:
@@ -383,161 +917,113 @@ def query_comp_proj_rel_time_series_execution(client: CloudantV1,
             combined_data[year] = {"Year": year}
         combined_data[year].update(item)
 
-    for year, metrics in combined_data.items():
-        project_gauge.labels(year=year).set(metrics.get("Project", 0))
-        component_gauge.labels(year=year).set(metrics.get("Component", 0))
-        release_gauge.labels(year=year).set(metrics.get("Release", 0))
+    # Drop children of a previous run once the new values are known, they
+    # may no longer exist
+    for gauge, doc in ((project_gauge, "Project"),
+                       (component_gauge, "Component"),
+                       (release_gauge, "Release")):
+        gauge.clear()
+        set_gauge_values(gauge, [
+            ((year,), metrics.get(doc, 0))
+            for year, metrics in combined_data.items()])
 
 
 # -------------Cleared/Not Cleared Release status based on Type----------------
 def query_execution_releases_ecc_cleared_status(result_rel, result_comp,
                                                 release_clearing_gauge: Gauge):
     print('\nExecuting the query for release clearing status................/')
+    comp_type_of = {doc["_id"]: doc.get("componentType")
+                    for doc in result_comp}.get
 
-    comp_data = [{
-        "id": doc["_id"], "componentType": doc.get("componentType")
-    } for doc in result_comp]
-
-    comp_lookup = {data["id"]: data for data in comp_data}
-
-    # Merge data from CouchDB into the original documents
-    merged_documents = [{
-        "id": doc["componentId"],
-        "status": None
-        if "eccInformation" not in doc
-           or "eccStatus" not in doc["eccInformation"]
-        else doc["eccInformation"]["eccStatus"],
-        "type": comp_lookup[
-            doc["componentId"]
-        ]["componentType"] if doc["componentId"] in comp_lookup else None
-    } for doc in result_rel]
-
-    # Count the occurrences of each type and status combination
-    type_status_count = defaultdict(int)
-    for doc in merged_documents:
-        type_status_count[(
-            doc["type"] if doc["type"] else "EMPTY",
-            doc["status"] if doc["status"] else "EMPTY")] += 1
+    # Count the occurrences of each type and status combination, joining
+    # the component type of each release on the fly
+    type_status_count = Counter(
+        (comp_type_of(doc["componentId"]) or "EMPTY",
+         (doc.get("eccInformation") or {}).get("eccStatus") or "EMPTY")
+        for doc in result_rel)
 
-    # Update Prometheus metrics
-    for (comp_type, status), count in type_status_count.items():
-        release_clearing_gauge.labels(type=comp_type,
-                                      status=status).set(count)
+    # Update Prometheus metrics, dropping children of a previous run
+    release_clearing_gauge.clear()
+    set_gauge_values(release_clearing_gauge, type_status_count.items())
 
 
 # ----------------------Most Used Components----------------------------------
 def query_execution_most_used_comp(result_rel,
                                    most_used_component_gauge: Gauge):
     print('\n Executing the query for most used components................../')
-
-    key_counts = {}
+    key_counts = Counter(item["componentId"] for item in result_rel)
+    # Name of the first release seen for each component
+    name_of = {}
     for item in result_rel:
-        key = item["componentId"]
-        name = item["name"]
-        if key in key_counts:
-            key_counts[key]["count"] += 1
-        else:
-            key_counts[key] = {"key": key, "Component name": name, "count": 1}
-
-    # Create the new list of dictionaries
-    result_list = list(key_counts.values())
-    sorted_list = sorted(result_list, key=lambda x: x["count"], reverse=True)
+        name_of.setdefault(item["componentId"], item["name"])
 
-    for item in sorted_list:
-        most_used_component_gauge.labels(
-            componentId=item["key"],
-            Component=item["Component name"]).set(item["count"])
+    # Drop children of a previous run, they may no longer exist
+    most_used_component_gauge.clear()
+    set_gauge_values(most_used_component_gauge, [
+        ((key, name_of[key]), count)
+        for key, count in key_counts.most_common()])
 
 
 # ------------------Most Used Licenses------------------
 def query_execution_most_used_licenses(result_comp,
                                        most_used_license_gauge: Gauge):
     print('\n Executing the query for most used licenses.................../')
+    license_count = Counter(chain.from_iterable(
+        doc.get("mainLicenseIds") or () for doc in result_comp))
 
-    license_list = []
-    for doc in result_comp:
-        if doc["mainLicenseIds"]:
-            for value in doc["mainLicenseIds"]:
-                license_list.append(value)
+    # Update Prometheus metrics, dropping children of a previous run
+    most_used_license_gauge.clear()
+    set_gauge_values(most_used_license_gauge, [
+        ((license_id,), count) for license_id, count in license_count.items()])
 
-    license_count = Counter(license_list)
 
-    # Update Prometheus metrics
-    for license_id, count in license_count.items():
-        most_used_license_gauge.labels(License=license_id).set(count)
+# --------------------Components that are not used-----------------------------
+# Project usages by release id, summed to 0 for releases nobody uses. The
+# view has its own design document, adding it to one of SW360's design
+# documents would rebuild all of their views
+release_usage_design_doc = "Unused"
+release_usage_view = "usageCountByReleaseId"
+release_usage_map_function = {
+    'map': "function(doc) {"
+           " if (doc.type == 'release') {"
+           "  emit(doc._id, 0);"
+           " } else if (doc.type == 'project' && doc.releaseIdToUsage) {"
+           "  for (var releaseId in doc.releaseIdToUsage) {"
+           "   emit(releaseId, 1);"
+           "  }"
+           " }"
+           "}",
+    'reduce': "_sum"
+}
+
+
+def fetch_unused_releases(client: CloudantV1, database: str):
+    """
+    Get the releases which are not used by any project. The releases and their
+    project usages are summed by a reduce view grouped by release id, only
+    the releases with no usage are fetched.
+    :param client: Cloudant client
+    :param database: Name of the database
+    :return: Generator over (component id, release name) of unused releases
+    """
+    save_new_view(client, database, release_usage_design_doc,
+                  release_usage_view, release_usage_map_function)
+
+    # Projects emit 1 per used release, a sum of 0 is a release nobody uses
+    unused_ids = [row["key"] for row in fetch_results(
+        client, database, release_usage_design_doc, release_usage_view,
+        group=True) if row["value"] == 0]
+    for doc in fetch_docs_by_ids(client, database, unused_ids, "release"):
+        yield doc.get("componentId"), doc.get("name")
 
 
-# --------------------Components that are not used-----------------------------
 def query_execution_comp_not_used(client: CloudantV1, database: str,
                                   unused_component_gauge: Gauge):
     print('\n Executing the query for components not being used............./')
-    # Create views to fetch necessary data
-    project_design_doc = "Project"
-    project_view = "byreleaseid"
-
-    project_map_function = {
-        'map': "function(doc) {"
-               " if (doc.type == 'project') {"
-               "  for(var i in doc.releaseIdToUsage) {"
-               "   emit(i, doc._id);"
-               "  }"
-               " }"
-               "}"
-    }
-
-    save_new_view(client, database, project_design_doc,
-                  project_view, project_map_function)
-
-    result = fetch_results(client, database, project_design_doc, project_view)
-    if result is None:
-        result = []
-    proj_rel_id_list = [row["key"] for row in result]
-
-    # Executing the view for all the releases
-    # Create views to fetch necessary data
-    release_design_doc = "Release"
-    release_view = "all"
-
-    project_map_function = {
-        'map': "function(doc) {"
-               " if (doc.type == 'release') emit(null, doc._id);"
-               "}"
-    }
-
-    save_new_view(client, database, release_design_doc, release_view,
-                  project_map_function)
-
-    result = list(fetch_results(client, database, release_design_doc,
-                                release_view))
-
-    rel_id_list = [row["value"] for row in result]
-
-    proj_rel_id_list = set(proj_rel_id_list)
-    rel_id_list = set(rel_id_list)
-
-    # Find values in the original list that are not in the input list
-    result_id_list = list(rel_id_list - proj_rel_id_list)
+    comp_result = dict(fetch_unused_releases(client, database))
 
-    try:
-        db_query = client.post_find(
-            database, {
-                "type": "release", "_id": {"$in": result_id_list}
-            }, limit=CLOUDANT_LIMIT_MAX).get_result()
-        result_rel = list(db_query["docs"])
-    except ApiException as ex:
-        print(f"Error: {ex}")
-        return None
-
-    comp_result = {}
-    for item in result_rel:
-        key = item["componentId"]
-        name = item["name"]
-        comp_result[key] = {"key": key, "name": name}
-
-    result_list = list(comp_result.values())
-
-    # Update Prometheus metrics
-    for item in result_list:
-        unused_component_gauge.labels(
-            component=item["key"], name=item["name"]).set(1)
+    # Update Prometheus metrics, dropping children of a previous run
+    unused_component_gauge.clear()
+    set_gauge_values(unused_component_gauge, [
+        ((key, name), 1) for key, name in comp_result.items()])
     return None
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# SPDX-License-Identifier: MIT
+# Copyright Siemens AG, 2025. Part of the SW360 Portal Project.
+#
+# This script removes the views earlier versions of the exporters created in
+# SW360's own design documents. The exporters keep their views in the
+# dashboard's design documents (Common, Unused), the old views are no longer
+# read but CouchDB keeps indexing them on every write.
+
+import argparse
+import time
+
+from sw360_dashboard.couchdb_utils import get_cloudant_client, \
+    get_sw360_db_name, get_attachment_db_name, remove_views
+
+# Views in the sw360 database, by design document
+SW360_OLD_VIEWS = [
+    ("Release", "byECCStatus"),
+    ("Release", "byReleaseIdAndComponent"),
+    ("Release", "byECCStatusAndName"),
+    ("Release", "byCreatedOn"),
+    ("Release", "byReleaseIdAndComponentId"),
+    ("Release", "countByComponentTypeAndECCStatus"),
+    ("Release", "countByComponentIdAndName"),
+    ("Release", "countByECCStatusComponentIdAndName"),
+    ("Release", "fieldsByComponentId"),
+    ("Release", "usageCountByReleaseId"),
+    ("Component", "bymainLicenseIdArr"),
+    ("Component", "byCreatedOn"),
+    ("Component", "countByMainLicenseId"),
+    ("Project", "byCreatedOn"),
+    ("Project", "byReleaseId"),
+    ("Project", "byReleaseUsage"),
+    ("Project", "releaseIdsById"),
+]
+
+# Views of each group exporter in the sw360 database
+GROUP_OLD_VIEWS = [
+    ("Project", "all{group}"),
+    ("Project", "countAll{group}"),
+]
+
+# Views in the attachment database
+ATTACHMENT_OLD_VIEWS = [
+    ("AttachmentContent", "totalDiskUsage"),
+    ("AttachmentContent", "totalAttachmentLength"),
+]
+
+
+def main(groups=()):
+    client = get_cloudant_client()
+    remove_views(client, get_sw360_db_name(), SW360_OLD_VIEWS + [
+        (design_doc, view.format(group=group))
+        for group in groups for design_doc, view in GROUP_OLD_VIEWS])
+    remove_views(client, get_attachment_db_name(), ATTACHMENT_OLD_VIEWS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'groups', nargs='*',
+        help='groups with an exporter, whose old views are removed too')
+    args = parser.parse_args()
+    try:
+        start_time = time.time()
+        main(args.groups)
+        print('\nExecution time: ' + "{0:.2f}"
+              .format(time.time() - start_time) + 's')
+
+    except KeyboardInterrupt:
+        print("\nExecution interrupted by user")
+    except Exception as e:
+        print('Exception message ', e)